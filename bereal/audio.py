@@ -0,0 +1,37 @@
+"""
+Encode songs to AAC once, so that rendering a video only has to copy the audio into place.
+"""
+
+import os
+
+from .beats import song_digest
+from .cache import DiskCache, make_key
+from .encoder import ffmpeg
+from .logger import logger
+from .utils import AUDIO_CACHE_MB, CACHE_PATH
+
+AUDIO_BITRATE = "192k"
+
+AUDIO_VERSION = 1
+
+audio_cache = DiskCache(os.path.join(CACHE_PATH, "audio"), AUDIO_CACHE_MB * 1024 * 1024, suffix=".m4a")
+
+
+def encode_audio(song_path: str) -> str:
+    """
+    Return the path of the song encoded as AAC, encoding it only if it hasn't been before.
+    """
+    key = make_key(AUDIO_VERSION, song_digest(song_path), AUDIO_BITRATE)
+
+    if (cached_path := audio_cache.get(key)) is not None:
+        logger.info("Using cached audio for %s", os.path.basename(song_path))
+        return cached_path
+
+    logger.info("Encoding %s to AAC", os.path.basename(song_path))
+
+    path = audio_cache.put(
+        key, lambda path: ffmpeg("-i", song_path, "-vn", "-c:a", "aac", "-b:a", AUDIO_BITRATE, "-f", "mp4", path)
+    )
+    audio_cache.evict()
+
+    return path
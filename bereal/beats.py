@@ -0,0 +1,203 @@
+"""
+Find the beats of a song, to time the slideshow to; analysis is cached by the song's contents.
+"""
+
+import json
+import math
+import os
+import threading
+import tracemalloc
+from importlib.metadata import version
+from time import perf_counter
+
+import librosa
+import numpy as np
+import soundfile as sf
+import soxr
+
+from .cache import DiskCache, hash_file, make_key
+from .logger import logger
+from .utils import (
+    BEAT_CACHE_MB,
+    CACHE_PATH,
+    CLASSIC_DURATION,
+    Mode,
+)
+
+# the analysis parameters; librosa's defaults, spelled out because they're part of the cache key
+SAMPLE_RATE = 22050
+HOP_LENGTH = 512
+
+# beat tracking only needs the rhythm, so the cheaper of soxr's resamplers is plenty
+RESAMPLE_QUALITY = "MQ"
+
+# how many frames of audio are decoded at a time
+BLOCK_SIZE = 1 << 16
+
+# the longest gap between beats worth planning for (i.e., 60 bpm); if a song has too few, they're repeated anyway
+MAX_BEAT_PERIOD = 1.0
+
+# analyzed prefixes are rounded up to a multiple of this many seconds, so that similar jobs share cache entries
+ANALYSIS_STEP = 30
+
+BEATS_VERSION = 2
+
+beat_cache = DiskCache(os.path.join(CACHE_PATH, "beats"), BEAT_CACHE_MB * 1024 * 1024, suffix=".json")
+
+# song hashes by (path, size, mtime), so the bundled songs are only hashed once per process
+song_digests: dict[tuple[str, int, float], str] = {}
+song_digests_lock = threading.Lock()
+
+
+def song_digest(song_path: str) -> str:
+    """
+    The SHA-256 of a song's contents, remembered for as long as the file is unchanged.
+    """
+    stat = os.stat(song_path)
+    key = (os.path.abspath(song_path), stat.st_size, stat.st_mtime)
+
+    with song_digests_lock:
+        if key in song_digests:
+            return song_digests[key]
+
+    digest = hash_file(song_path)
+
+    with song_digests_lock:
+        song_digests[key] = digest
+
+    return digest
+
+
+def analysis_seconds(n_images: int, mode: Mode) -> int:
+    """
+    How much of a song has to be analyzed to time a slideshow of n_images images.
+
+    Every image needs a beat; classic videos are also cut to CLASSIC_DURATION seconds, song and all, so beats after
+    that never line up with anything.
+    """
+    needed = (n_images + 1) * MAX_BEAT_PERIOD
+    if mode == Mode.CLASSIC:
+        needed = min(needed, CLASSIC_DURATION)
+
+    return math.ceil(needed / ANALYSIS_STEP) * ANALYSIS_STEP
+
+
+# the most any job could need: a modern video of a leap year
+LONGEST_ANALYSIS = analysis_seconds(366, Mode.MODERN)
+
+
+def song_seconds(song_path: str) -> int:
+    """
+    A song's length, rounded up like analysis_seconds; analyzing any further than this gives the same beats.
+    """
+    return math.ceil(librosa.get_duration(path=song_path) / ANALYSIS_STEP) * ANALYSIS_STEP
+
+
+def load_prefix(song_path: str, seconds: int) -> np.ndarray:
+    """
+    Decode the first `seconds` of a song as mono audio at SAMPLE_RATE.
+
+    The song is read, downmixed, and resampled a block at a time, so only the (mono, resampled) result is ever held
+    in memory in full, however long or wide the file is.
+    """
+    try:
+        song_file = sf.SoundFile(song_path)
+    except sf.LibsndfileError as error:
+        # e.g., an mp3 on an old libsndfile; librosa falls back to audioread, which at least stops at the prefix
+        logger.warning("Can't stream %s (%s); loading it with librosa", song_path, error)
+        y, _ = librosa.load(song_path, sr=SAMPLE_RATE, duration=seconds)
+        return y
+
+    with song_file:
+        resampler = (
+            soxr.ResampleStream(song_file.samplerate, SAMPLE_RATE, 1, dtype="float32", quality=RESAMPLE_QUALITY)
+            if song_file.samplerate != SAMPLE_RATE
+            else None
+        )
+
+        chunks: list[np.ndarray] = []
+        n_frames = seconds * song_file.samplerate
+
+        for block in song_file.blocks(blocksize=BLOCK_SIZE, frames=n_frames, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            chunks.append(resampler.resample_chunk(mono) if resampler is not None else mono)
+
+        if resampler is not None:
+            chunks.append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+
+def analyze_beats(song_path: str, seconds: int) -> list[float]:
+    """
+    Decode the first `seconds` of a song and track its beats; return the time of each beat, in seconds.
+    """
+    start = perf_counter()
+
+    # decoding is what grows with the song; leave tracing alone if something else already started it
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+
+    tracemalloc.reset_peak()
+    try:
+        y = load_prefix(song_path, seconds)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    _, beat_frames = librosa.beat.beat_track(y=y, sr=SAMPLE_RATE, hop_length=HOP_LENGTH)
+    beat_times = librosa.frames_to_time(beat_frames, sr=SAMPLE_RATE, hop_length=HOP_LENGTH)
+
+    logger.info(
+        "Analyzed the first %ds of %s in %.2fs; decoding peaked at %.1f MB",
+        seconds,
+        os.path.basename(song_path),
+        perf_counter() - start,
+        peak / (1024 * 1024),
+    )
+    return [float(value) for value in beat_times]
+
+
+def beats_key(digest: str, seconds: int) -> str:
+    """
+    The cache key of a song's beats, analyzed up to `seconds` in.
+    """
+    return make_key(
+        BEATS_VERSION, digest, seconds, SAMPLE_RATE, HOP_LENGTH, RESAMPLE_QUALITY, version("librosa"), version("soxr")
+    )
+
+
+def find_beats(song_path: str, seconds: int = LONGEST_ANALYSIS) -> list[float]:
+    """
+    The time of each beat in the first `seconds` of a song; only analyzed if the song hasn't been before.
+
+    Never more than the song is analyzed, however long a prefix is asked for. A cached analysis of a longer prefix
+    will do too, trimmed down to size.
+    """
+    digest = song_digest(song_path)
+    seconds = min(seconds, song_seconds(song_path))
+
+    for cached_seconds in [seconds, *range(seconds + ANALYSIS_STEP, LONGEST_ANALYSIS + 1, ANALYSIS_STEP)]:
+        if (cached_path := beat_cache.get(beats_key(digest, cached_seconds))) is None:
+            continue
+
+        try:
+            with open(cached_path) as cached_file:
+                logger.info("Using cached beats for %s", os.path.basename(song_path))
+                return [beat_time for beat_time in json.load(cached_file) if beat_time <= seconds]
+        except (OSError, json.JSONDecodeError) as error:
+            logger.warning("Ignoring unreadable cached beats %s: %s", cached_path, error)
+
+    key = beats_key(digest, seconds)
+    beat_times = analyze_beats(song_path, seconds)
+
+    def write(path: str) -> None:
+        with open(path, "w") as beats_file:
+            json.dump(beat_times, beats_file)
+
+    beat_cache.put(key, write)
+    beat_cache.evict()
+
+    return beat_times
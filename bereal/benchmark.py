@@ -0,0 +1,139 @@
+"""
+Benchmarks for the slow stages of making a video, on synthetic images.
+
+Run with `python -m bereal.benchmark <stage>`.
+"""
+
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from .encoder import encode_slideshow
+from .images import Compositor, ImagePair, composite_all
+from .utils import RENDER_SIZE
+
+# the resolution of BeReal's full-size images
+IMAGE_SIZE = (1500, 2000)
+
+
+def make_pairs(folder: str, n_images: int) -> list[ImagePair]:
+    """
+    Write n_images synthetic primary/secondary JPEG pairs into folder.
+    """
+    rng = np.random.default_rng(0)
+    width, height = IMAGE_SIZE
+
+    # a smooth gradient plus noise compresses (and decompresses) roughly like a photo
+    gradient = np.linspace(0, 255, width * height).reshape(height, width)
+
+    pairs: list[ImagePair] = []
+    for i in range(n_images):
+        label = f"2023-01-{i % 28 + 1:02d}"
+        paths = []
+
+        for kind in ["primary", "secondary"]:
+            noise = rng.normal(0, 20, (height, width, 3))
+            pixels = np.clip(gradient[..., None] + noise, 0, 255).astype(np.uint8)
+
+            path = os.path.join(folder, f"{label}_{kind}-{i}.jpg")
+            Image.fromarray(pixels).save(path, quality=90)
+            paths.append(path)
+
+        pairs.append((label, paths[0], paths[1]))
+
+    return pairs
+
+
+def make_frames(folder: str, n_images: int) -> list[str]:
+    """
+    Write n_images synthetic composites, at the render size, into folder.
+    """
+    rng = np.random.default_rng(0)
+    width, height = RENDER_SIZE
+
+    gradient = np.linspace(0, 255, width * height).reshape(height, width)
+
+    paths: list[str] = []
+    for i in range(n_images):
+        noise = rng.normal(0, 20, (height, width, 3))
+        pixels = np.clip(gradient[..., None] + noise, 0, 255).astype(np.uint8)
+
+        path = os.path.join(folder, f"combined_{i:04d}.jpg")
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+
+    return paths
+
+
+def benchmark_compositing(n_images: int, worker_counts: list[int]) -> None:
+    """
+    Time compositing n_images pairs with each number of workers.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"Generating {n_images} synthetic image pairs...")
+        pairs = make_pairs(folder, n_images)
+        compositor = Compositor()
+
+        print(f"{'workers':>8} {'seconds':>8} {'images/s':>9} {'speedup':>8}")
+
+        baseline = None
+        for workers in worker_counts:
+            output_folder = os.path.join(folder, f"combined-{workers}")
+            os.makedirs(output_folder)
+
+            start = perf_counter()
+            composite_all(compositor, pairs, output_folder, workers)
+            elapsed = perf_counter() - start
+
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>8.2f} {n_images / elapsed:>9.1f} {baseline / elapsed:>7.2f}x")
+
+
+def benchmark_encoding(n_images: int, segment_counts: list[int], preview: bool) -> None:
+    """
+    Time encoding n_images frames, about half a beat each, split into each number of segments.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"Generating {n_images} synthetic frames...")
+        image_paths = make_frames(folder, n_images)
+        durations = np.random.default_rng(0).uniform(0.3, 0.7, n_images).tolist()
+
+        print(f"{os.cpu_count()} cores")
+        print(f"{'segments':>8} {'seconds':>8} {'images/s':>9} {'speedup':>8}")
+
+        baseline = None
+        for segments in segment_counts:
+            start = perf_counter()
+            encode_slideshow(
+                image_paths, durations, None, os.path.join(folder, f"out-{segments}.mp4"), preview, segments
+            )
+            elapsed = perf_counter() - start
+
+            baseline = baseline or elapsed
+            print(f"{segments:>8} {elapsed:>8.2f} {n_images / elapsed:>9.1f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BeReal benchmarks")
+    subparsers = parser.add_subparsers(dest="stage", required=True)
+
+    compositing = subparsers.add_parser("compositing", help="Composite synthetic images with 1..N threads")
+    compositing.add_argument("--images", type=int, default=60, help="The number of image pairs to composite")
+    compositing.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="The worker counts to try")
+
+    encoding = subparsers.add_parser("encoding", help="Encode synthetic frames in 1..N parallel segments")
+    encoding.add_argument("--images", type=int, default=365, help="The number of frames to encode")
+    encoding.add_argument("--segments", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="The segment counts to try")
+    encoding.add_argument("--preview", action="store_true", help="Encode with the preview settings")
+
+    args = parser.parse_args()
+
+    match args.stage:
+        case "compositing":
+            benchmark_compositing(args.images, args.workers)
+        case "encoding":
+            benchmark_encoding(args.images, args.segments, args.preview)
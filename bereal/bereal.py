@@ -2,17 +2,43 @@
 Methods to interface with the unofficial BeReal API.
 """
 
+import hashlib
+import json
 import os
+import random
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any
+from time import perf_counter, sleep, time
+from typing import Any, cast
 
 import requests as r
+from requests.adapters import HTTPAdapter
 
 from .logger import logger
-from .utils import BASE_URL, CONTENT_PATH, TIMEOUT, str2datetime
+from .utils import (
+    API_BACKOFF,
+    API_MAX_BACKOFF,
+    API_RETRIES,
+    BASE_URL,
+    CONTENT_PATH,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_WORKERS,
+    FEED_TTL,
+    TIMEOUT,
+    str2datetime,
+    write_json,
+)
 
 from typing import TypedDict, Literal
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MANIFEST_FILENAME = "manifest.json"
+PREVIEW_MANIFEST_FILENAME = "manifest-preview.json"
+FEED_FILENAME = "feed.json"
+
 
 class MediaInfo(TypedDict):
     """
@@ -41,6 +67,170 @@ class BeRealPost(TypedDict):
     numPostsForMoment: int
 
 
+MediaKind = Literal["primary", "secondary", "thumbnail"]
+
+# which media to download, and the folder each lands in; previews only need the (much smaller) thumbnail
+FULL_MEDIA: list[tuple[MediaKind, str]] = [("primary", "mainPostPrimaryMedia"), ("secondary", "mainPostSecondaryMedia")]
+PREVIEW_MEDIA: list[tuple[MediaKind, str]] = [("thumbnail", "mainPostThumbnail")]
+
+
+class ManifestEntry(TypedDict):
+    """
+    The download record of a single image, as stored in the per-year manifest.
+    """
+
+    momentId: str
+    memoryDay: str
+    kind: MediaKind
+    url: str
+    path: str
+    size: int
+    sha256: str
+    status: Literal["done", "failed"]
+
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# requests that mustn't be repeated once the server may have acted on them; sending another code texts the user again
+NON_IDEMPOTENT_ENDPOINTS = {"login/send-code"}
+
+
+def make_session(pool_size: int) -> r.Session:
+    """
+    Create a session that keeps up to pool_size connections alive per host.
+    """
+    session = r.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+@dataclass
+class EndpointStats:
+    """
+    Request counters for a single endpoint.
+    """
+
+    requests: int = 0
+    attempts: int = 0
+    failures: int = 0
+    latency: float = 0.0
+
+
+class BeRealClient:
+    """
+    A pooled HTTP client for the BeReal API and its image CDN.
+
+    Connections are kept alive between calls, and requests that fail with a connection error, a 429, or a 5xx are
+    retried with jittered exponential backoff, up to max_backoff seconds at a time (however long the server asks for).
+    Requests to NON_IDEMPOTENT_ENDPOINTS aren't retried once they've timed out waiting for a response, since the server
+    may have acted on them already. A single instance is shared by the web server and the celery worker.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = DOWNLOAD_WORKERS,
+        retries: int = API_RETRIES,
+        backoff: float = API_BACKOFF,
+        max_backoff: float = API_MAX_BACKOFF,
+        timeouts: dict[str, float] | None = None,
+    ) -> None:
+        self.session = make_session(pool_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeouts = timeouts or {
+            "login/send-code": TIMEOUT,
+            "login/verify": TIMEOUT,
+            "friends/mem-feed": TIMEOUT,
+            "cdn": DOWNLOAD_TIMEOUT,
+        }
+
+        self.stats: dict[str, EndpointStats] = {}
+        self.lock = threading.Lock()
+
+    def get(self, endpoint: str, url: str | None = None, **kwargs: Any) -> r.Response:
+        """
+        Issue a GET request; url defaults to the API URL for the endpoint.
+        """
+        return self.request("GET", endpoint, url, **kwargs)
+
+    def post(self, endpoint: str, url: str | None = None, **kwargs: Any) -> r.Response:
+        """
+        Issue a POST request; url defaults to the API URL for the endpoint.
+        """
+        return self.request("POST", endpoint, url, **kwargs)
+
+    def request(self, method: str, endpoint: str, url: str | None = None, **kwargs: Any) -> r.Response:
+        """
+        Issue a request, retrying transient failures.
+
+        Return the last response, even if it's still an error; re-raise the last exception if every attempt failed to
+        connect.
+        """
+        url = url or f"{BASE_URL}/{endpoint}"
+        kwargs.setdefault("timeout", self.timeouts.get(endpoint, TIMEOUT))
+
+        start = perf_counter()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            delay = min(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5), self.max_backoff)
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (r.ConnectionError, r.Timeout) as error:
+                sent = isinstance(error, r.ReadTimeout) and endpoint in NON_IDEMPOTENT_ENDPOINTS
+
+                if attempt > self.retries or sent:
+                    self._record(endpoint, attempt, perf_counter() - start, ok=False)
+                    raise
+
+                logger.warning("%s %s failed with %s; retrying in %.1fs", method, endpoint, error, delay)
+                sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt > self.retries:
+                self._record(endpoint, attempt, perf_counter() - start, ok=response.ok)
+                return response
+
+            # respect the server's hint, if it gave one in seconds
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = min(max(delay, float(retry_after)), self.max_backoff)
+
+            logger.warning("%s %s returned %d; retrying in %.1fs", method, endpoint, response.status_code, delay)
+            response.close()
+            sleep(delay)
+
+    def _record(self, endpoint: str, attempts: int, latency: float, ok: bool) -> None:
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+
+            stats.requests += 1
+            stats.attempts += attempts
+            stats.failures += 0 if ok else 1
+            stats.latency += latency
+
+    def summary(self) -> str:
+        """
+        A human-readable summary of every endpoint's counters, for the logs.
+        """
+        with self.lock:
+            return "; ".join(
+                f"{endpoint}: {stats.requests} requests, {stats.attempts} attempts, {stats.failures} failed, "
+                f"{stats.latency / max(stats.requests, 1) * 1000:.0f} ms mean latency"
+                for endpoint, stats in self.stats.items()
+            )
+
+
+client = BeRealClient()
+
+
 def send_code(phone: str) -> Any | None:
     """
     Send a code to the given phone number.
@@ -54,7 +244,7 @@ def send_code(phone: str) -> Any | None:
     payload = {"phone": phone}
 
     logger.info("Sending OTP session request...")
-    response = r.post(f"{BASE_URL}/login/send-code", json=payload, timeout=TIMEOUT)
+    response = client.post("login/send-code", json=payload)
 
     match response.status_code:
         case 201:
@@ -81,7 +271,7 @@ def verify_code(otp_session: Any, otp_code: str) -> str | None:
     """
     payload_verify = {"code": otp_code, "otpSession": otp_session}
 
-    response = r.post(f"{BASE_URL}/login/verify", json=payload_verify, timeout=TIMEOUT)
+    response = client.post("login/verify", json=payload_verify)
 
     match response.status_code:
         case 201:
@@ -96,77 +286,323 @@ def verify_code(otp_session: Any, otp_code: str) -> str | None:
             return None
 
 
-def memories(phone: str, year: str, token: str, sdate: datetime, edate: datetime) -> bool:
+@dataclass
+class DownloadStats:
     """
-    Fetch user 'memories' (i.e., the images).
-
-    Skip to this stage if we already acquired reusable token.
+    A summary of a batch of image downloads; safe to update from multiple threads.
     """
-    headers = {"token": token}
-
-    primary_path = os.path.join(CONTENT_PATH, phone, year, "primary")
-    secondary_path = os.path.join(CONTENT_PATH, phone, year, "secondary")
 
-    if os.path.isdir(primary_path) and os.path.isdir(secondary_path):
-        logger.info("Skipping 'memories' stage; already downloaded!")
-        return True
+    files: int = 0
+    failures: int = 0
+    bytes: int = 0
+    latency: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
 
-    os.makedirs(primary_path, exist_ok=True)
-    os.makedirs(secondary_path, exist_ok=True)
-
-    response = r.get(f"{BASE_URL}/friends/mem-feed", headers=headers, timeout=TIMEOUT)
-    data_array: list[Any] = []
+    def record(self, n_bytes: int, latency: float, ok: bool) -> None:
+        """
+        Record the outcome of a single download.
+        """
+        with self.lock:
+            self.latency += latency
 
-    if response.status_code == 200:
-        response_json = response.json()
-        logger.debug("memories", response_json)
-        data_array: list[BeRealPost] = response_json["data"].get("data", [])
-    else:
-        logger.warning("Request failed with status code %s", response.status_code)
-        return False
+            if ok:
+                self.files += 1
+                self.bytes += n_bytes
+            else:
+                self.failures += 1
 
-    def download_image(date_str: str, url: str, base_path: str) -> None:
+    def summary(self) -> str:
         """
-        Download an image to the base path folder.
+        A human-readable summary, for the logs.
         """
-        date = str2datetime(date_str)
+        attempts = self.files + self.failures
+        mean_latency = self.latency / attempts if attempts > 0 else 0.0
 
-        if not url:
-            logger.warning("Missing URL")
-            return None
+        return (
+            f"{self.files} downloaded, {self.failures} failed, "
+            f"{self.bytes / 1_000_000:.1f} MB, {mean_latency * 1000:.0f} ms mean latency"
+        )
 
-        if date < sdate or date > edate:
-            logger.debug("Invalid date: %s", date_str)
-            return None
 
-        # Extracting the image name from the URL
-        image_name = date_str + "_" + url.split("/")[-1]
+def download_image(url: str, image_path: str, stats: DownloadStats) -> tuple[int, str] | None:
+    """
+    Download a single image to image_path. Return its size and SHA-256 digest, or None on failure.
 
-        with open(os.path.join(base_path, image_name), "wb") as img_file:
-            img_response = r.get(url, timeout=10)
+    The body is streamed to a temporary file and only renamed into place once it is complete, so a failed download
+    never leaves a partial (or empty) image behind.
+    """
+    image_name = os.path.basename(image_path)
+    partial_path = f"{image_path}.part"
+    start = perf_counter()
 
-            if img_response.status_code == 200:
-                img_file.write(img_response.content)
-                logger.debug("Downloaded %s", image_name)
-            else:
+    try:
+        with client.get("cdn", url, stream=True) as img_response:
+            if img_response.status_code != 200:
                 logger.warning(
                     "Failed to download %s with code %d; will continue", image_name, img_response.status_code
                 )
+                stats.record(0, perf_counter() - start, ok=False)
+                return None
+
+            n_bytes = 0
+            digest = hashlib.sha256()
+            with open(partial_path, "wb") as img_file:
+                for chunk in img_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    img_file.write(chunk)
+                    digest.update(chunk)
+                    n_bytes += len(chunk)
+
+            # requests transparently decodes compressed bodies, so the declared length only applies to identity ones
+            content_length = img_response.headers.get("Content-Length")
+            if content_length is not None and "Content-Encoding" not in img_response.headers:
+                if n_bytes != int(content_length):
+                    logger.warning(
+                        "Truncated download of %s (%d of %s bytes); will continue", image_name, n_bytes, content_length
+                    )
+                    stats.record(0, perf_counter() - start, ok=False)
+                    return None
+
+            os.replace(partial_path, image_path)
+            stats.record(n_bytes, perf_counter() - start, ok=True)
+
+            logger.debug("Downloaded %s", image_name)
+            return n_bytes, digest.hexdigest()
+    except (r.RequestException, OSError) as error:
+        logger.warning("Failed to download %s with error %s; will continue", image_name, error)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    stats.record(0, perf_counter() - start, ok=False)
+    return None
+
+
+def manifest_path(year_path: str, preview: bool = False) -> str:
+    """
+    Where the download manifest for a phone/year folder lives. Previews and full videos download different media, and
+    may do so at the same time, so each keeps its own manifest; otherwise the last one to save would drop the other's.
+    """
+    return os.path.join(year_path, PREVIEW_MANIFEST_FILENAME if preview else MANIFEST_FILENAME)
+
+
+def load_manifest(year_path: str, preview: bool = False) -> dict[str, ManifestEntry]:
+    """
+    Load the download manifest for a phone/year folder, keyed by "<momentId>:<kind>".
+    """
+    path = manifest_path(year_path, preview)
+
+    if not os.path.isfile(path):
+        return {}
+
+    try:
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, json.JSONDecodeError) as error:
+        logger.warning("Ignoring unreadable manifest %s: %s", path, error)
+        return {}
+
+
+def save_manifest(year_path: str, manifest: dict[str, ManifestEntry], preview: bool = False) -> None:
+    """
+    Atomically write the download manifest for a phone/year folder.
+    """
+    write_json(manifest_path(year_path, preview), manifest)
+
+
+def is_downloaded(year_path: str, entry: ManifestEntry | None) -> bool:
+    """
+    Whether a manifest entry refers to a completed download that is still intact on disk.
+    """
+    if entry is None or entry["status"] != "done":
+        return False
+
+    image_path = os.path.join(year_path, entry["path"])
+    return os.path.isfile(image_path) and os.path.getsize(image_path) == entry["size"]
+
+
+def failed_downloads(
+    phone: str, year: str, sdate: datetime, edate: datetime, preview: bool = False
+) -> list[ManifestEntry]:
+    """
+    The images between sdate and edate (of the kinds a preview, or a full video, needs) that failed to download.
+    """
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+    kinds = [kind for kind, _ in (PREVIEW_MEDIA if preview else FULL_MEDIA)]
+
+    return [
+        entry
+        for entry in load_manifest(year_path, preview).values()
+        if entry["status"] == "failed" and entry["kind"] in kinds and sdate <= str2datetime(entry["memoryDay"]) <= edate
+    ]
+
+
+def fetch_feed(phone: str, token: str, refresh: bool = False) -> tuple[list[BeRealPost], bool] | None:
+    """
+    Fetch a user's full memories feed, reusing a cached copy if it's younger than FEED_TTL seconds.
+
+    The feed covers every year, so one cached copy serves renders of any year. Return the posts and whether they came
+    from the cache, or None if the request failed.
+    """
+    feed_path = os.path.join(CONTENT_PATH, phone, FEED_FILENAME)
+
+    if not refresh and os.path.isfile(feed_path) and time() - os.path.getmtime(feed_path) < FEED_TTL:
+        try:
+            with open(feed_path) as feed_file:
+                data_array: list[BeRealPost] = json.load(feed_file)
+
+            logger.info("Using cached memories feed for %s", phone)
+            return data_array, True
+        except (OSError, json.JSONDecodeError) as error:
+            logger.warning("Ignoring unreadable feed cache %s: %s", feed_path, error)
+
+    headers = {"token": token}
+    response = client.get("friends/mem-feed", headers=headers)
+
+    if response.status_code != 200:
+        logger.warning("Request failed with status code %s", response.status_code)
+        return None
+
+    response_json = response.json()
+    logger.debug("memories: %s", response_json)
+    data_array = response_json["data"].get("data", [])
+
+    if len(data_array) > 0:
+        os.makedirs(os.path.dirname(feed_path), exist_ok=True)
+        write_json(feed_path, data_array)
+
+    return data_array, False
+
+
+def invalidate_feed(phone: str) -> None:
+    """
+    Drop the cached memories feed for a user, so the next fetch goes upstream.
+    """
+    feed_path = os.path.join(CONTENT_PATH, phone, FEED_FILENAME)
+
+    try:
+        os.remove(feed_path)
+        logger.info("Invalidated cached memories feed for %s", phone)
+    except FileNotFoundError:
+        pass
+
+
+def memories(
+    phone: str,
+    year: str,
+    token: str,
+    sdate: datetime,
+    edate: datetime,
+    refresh_feed: bool = False,
+    preview: bool = False,
+    on_download: Callable[[ManifestEntry], None] | None = None,
+) -> bool:
+    """
+    Fetch user 'memories' (i.e., the images).
+
+    Skip to this stage if we already acquired reusable token. In preview mode, only fetch each post's thumbnail.
+
+    If given, on_download is called with the manifest entry of every image that's available on disk, as soon as it
+    is; images reused from a previous run are reported before any new downloads start.
+    """
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+    media = PREVIEW_MEDIA if preview else FULL_MEDIA
+
+    for kind, _ in media:
+        os.makedirs(os.path.join(year_path, kind), exist_ok=True)
+
+    feed = fetch_feed(phone, token, refresh=refresh_feed)
+    if feed is None:
+        return False
+
+    data_array, from_cache = feed
 
     if len(data_array) == 0:
         logger.warning("No data found in the response!")
         return False
 
-    # iterate through the response and download images
+    # only fetch what the manifest doesn't already have intact on disk; everything else is reused
+    manifest = load_manifest(year_path, preview)
+    downloads: list[ManifestEntry] = []
+    reused: list[ManifestEntry] = []
+
     for item in data_array:
         logger.debug("Processing %s", item)
 
         date_str = item.get("memoryDay", "")
+        date = str2datetime(date_str)
 
-        primary_image_url = item["mainPostPrimaryMedia"].get("url", "")
-        download_image(date_str, primary_image_url, primary_path)
-
-        secondary_image_url = item["mainPostSecondaryMedia"].get("url", "")
-        download_image(date_str, secondary_image_url, secondary_path)
+        if date < sdate or date > edate:
+            logger.debug("Invalid date: %s", date_str)
+            continue
+
+        for kind, media_key in media:
+            media_info = cast(dict[str, MediaInfo], item).get(media_key)
+            url = media_info.get("url", "") if media_info else ""
+
+            if not url:
+                logger.warning("Missing URL")
+                continue
+
+            key = f"{item['momentId']}:{kind}"
+            if is_downloaded(year_path, manifest.get(key)):
+                reused.append(manifest[key])
+                continue
+
+            # Extracting the image name from the URL
+            image_name = date_str + "_" + url.split("/")[-1]
+            downloads.append(
+                {
+                    "momentId": item["momentId"],
+                    "memoryDay": date_str,
+                    "kind": kind,
+                    "url": url,
+                    "path": os.path.join(kind, image_name),
+                    "size": 0,
+                    "sha256": "",
+                    "status": "failed",
+                }
+            )
+
+    stats = DownloadStats()
+    logger.info(
+        "Downloading %d images with %d workers (%d already downloaded)...",
+        len(downloads),
+        DOWNLOAD_WORKERS,
+        len(reused),
+    )
+
+    if on_download is not None:
+        for entry in reused:
+            on_download(entry)
+
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            futures = {
+                pool.submit(download_image, entry["url"], os.path.join(year_path, entry["path"]), stats): entry
+                for entry in downloads
+            }
+
+            for future in as_completed(futures):
+                entry = futures[future]
+                result = future.result()
+
+                if result is not None:
+                    entry["size"], entry["sha256"] = result
+                    entry["status"] = "done"
+
+                manifest[f"{entry['momentId']}:{entry['kind']}"] = entry
+
+                if result is not None and on_download is not None:
+                    on_download(entry)
+    finally:
+        # record progress even if we're interrupted, so the next run only fetches what's missing
+        save_manifest(year_path, manifest, preview)
+
+    logger.info("Finished 'memories' stage: %s", stats.summary())
+
+    # the cached feed's media URLs may have expired; make sure a retry asks for fresh ones
+    if from_cache and stats.failures > 0:
+        invalidate_feed(phone)
+    logger.debug("BeReal client: %s", client.summary())
 
     return True
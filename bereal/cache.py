@@ -0,0 +1,142 @@
+"""
+A size-bounded, content-addressed cache of files on disk, shared by every job.
+"""
+
+import hashlib
+import os
+import threading
+from collections.abc import Callable
+
+from .logger import logger
+
+# how much of a file to hash at a time
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """
+    The SHA-256 of a file's contents, as hex.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def make_key(*parts: object) -> str:
+    """
+    Hash some values (e.g., content hashes and settings) into a single cache key.
+
+    Every kind of key leads with a version of its own (AUDIO_VERSION, BEATS_VERSION, CARD_VERSION, COMPOSITE_VERSION,
+    JOB_VERSION); bump it whenever a code change alters the result in a way the other parts don't capture, so that
+    entries made by the old code stop matching.
+    """
+    return hashlib.sha256("\x00".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class DiskCache:
+    """
+    A folder of files named by their key, evicted least-recently-used first once they exceed `max_bytes`.
+
+    Entries are written atomically, so several threads (or workers sharing the folder) can fill it at once; at worst,
+    two of them compute the same entry. An entry's mtime is its last use.
+    """
+
+    def __init__(self, folder: str, max_bytes: int, suffix: str = "") -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """
+        Where the entry for a key lives; sharded by prefix, to keep directories small.
+        """
+        return os.path.join(self.folder, key[:2], f"{key}{self.suffix}")
+
+    def get(self, key: str) -> str | None:
+        """
+        Return the path of a key's entry, or None if it isn't cached.
+        """
+        path = self.path(key)
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def put(self, key: str, write: Callable[[str], object]) -> str:
+        """
+        Add an entry, by calling `write` with a temporary path to fill in; return the entry's path.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            write(partial_path)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        return path
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used entries until the cache fits in `max_bytes` again.
+        """
+        entries: list[tuple[float, int, str]] = []
+
+        for root, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if filename.endswith(".part"):
+                    continue
+
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return None
+
+        n_evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total -= size
+            n_evicted += 1
+
+        logger.info("Evicted %d entries from %s; %d bytes remain", n_evicted, self.folder, total)
+        return None
+
+    def summary(self) -> str:
+        """
+        A one-line summary of how well the cache did, for the logs.
+        """
+        return f"{self.hits} hits, {self.misses} misses in {self.folder}"
@@ -0,0 +1,105 @@
+"""
+Title cards shown before and after a slideshow, encoded once per distinct text and reused by every video.
+"""
+
+import os
+import tempfile
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .cache import DiskCache, hash_file, make_key
+from .encoder import Segment, encode_video, video_args
+from .logger import logger
+from .utils import (
+    CACHE_PATH,
+    CARD_CACHE_MB,
+    ENDCARD_DURATION,
+    ENDCARD_TEMPLATE_IMAGE_PATH,
+    FONT_BASE_PATH,
+    INTRO_DURATION,
+    PREVIEW_RENDER_SIZE,
+    RENDER_SIZE,
+)
+
+CARD_VERSION = 1
+
+card_cache = DiskCache(os.path.join(CACHE_PATH, "cards"), CARD_CACHE_MB * 1024 * 1024, suffix=".mp4")
+
+FONT_PATH = os.path.join(FONT_BASE_PATH, "Inter-SemiBold.ttf")
+
+
+def draw_card(text: str, size: tuple[int, int], font_size: int = 50, offset: int = 110) -> Image.Image:
+    """
+    The card template with the text centered (offset downwards by `offset`), scaled to the given size.
+
+    The font size and offset are in the template's pixels.
+    """
+    img = Image.open(ENDCARD_TEMPLATE_IMAGE_PATH).convert("RGB")
+    width, height = img.size
+
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.truetype(FONT_PATH, font_size)
+
+    # Get the bounding box of the text
+    text_bbox = draw.textbbox((0, 0), text, font=font)
+
+    # Calculate the position to center the text
+    x = (width - text_bbox[2]) // 2
+    y = (height - text_bbox[3]) // 2 + offset
+
+    draw.text((x, y), text, font=font, fill="white")
+
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def card_segment(text: str, duration: float, preview: bool = False) -> Segment:
+    """
+    A card encoded just like the slideshow's own segments, so it can be joined to them without re-encoding.
+    """
+    size = PREVIEW_RENDER_SIZE if preview else RENDER_SIZE
+    key = make_key(
+        CARD_VERSION,
+        text,
+        duration,
+        size,
+        video_args(preview),
+        hash_file(ENDCARD_TEMPLATE_IMAGE_PATH),
+        hash_file(FONT_PATH),
+    )
+
+    if (cached_path := card_cache.get(key)) is not None:
+        return cached_path, duration
+
+    logger.info("Encoding card '%s'", text)
+
+    def write(path: str) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            image_path = os.path.join(folder, "card.png")
+            draw_card(text, size).save(image_path)
+
+            encode_video([image_path], [duration], path, preview)
+
+    path = card_cache.put(key, write)
+    card_cache.evict()
+
+    return path, duration
+
+
+def intro_segment(year: str, preview: bool = False) -> Segment | None:
+    """
+    The card before the slideshow, or None if intros are turned off (i.e., intro_duration is 0).
+    """
+    if INTRO_DURATION <= 0:
+        return None
+
+    return card_segment(f"{year}, Wrapped.", INTRO_DURATION, preview)
+
+
+def endcard_segment(n_images: int, preview: bool = False) -> Segment | None:
+    """
+    The card after the slideshow, "n_images memories and counting...", or None if end cards are turned off.
+    """
+    if ENDCARD_DURATION <= 0:
+        return None
+
+    return card_segment(f"{n_images} memories and counting...", ENDCARD_DURATION, preview)
@@ -1,72 +1,410 @@
 """
 Celery stuff.
+
+Making a video is a canvas of smaller tasks: download, then composite (in shards, in parallel), then render, then
+notify. Network-bound stages go to the "io" queue and CPU-bound ones to the "cpu" queue, so each can have its own
+workers, and stages of different jobs interleave instead of one job holding a worker for its whole run.
+
+The download stage composites each day into the composite cache as soon as its images are on disk (see pipeline.py),
+so compositing overlaps with downloading, and the composite stage mostly just looks the days up.
+
+Every stage is checkpointed (see checkpoints.py) and retried if it fails, so a job that times out or runs out of memory
+halfway through the render doesn't download and composite everything all over again.
+
+A job can be cancelled (e.g., when the user asks for a different video): its stages that haven't started never do,
+and the ones that are running are terminated, ffmpeg and all.
 """
 
 import gc
-from celery import Celery
+import os
+import signal
+from collections.abc import Callable
+from time import perf_counter
+from typing import Any
 
-from .bereal import memories
-from .images import create_images, cleanup_images
+from celery import Celery, Task, chain, chord, group
+from celery.canvas import Signature
+from celery.exceptions import Ignore
+from celery.signals import worker_process_init, worker_ready
+
+from .audio import encode_audio
+from .beats import find_beats
+from .bereal import failed_downloads
+from .checkpoints import (
+    Incomplete,
+    TooManyAttempts,
+    checkpointed,
+    clear_checkpoints,
+    composite_inputs,
+    download_inputs,
+    render_inputs,
+    stage_name,
+)
+from .encoder import stop_ffmpeg
+from .estimates import count_days, record_queue_duration, timed
+from .images import FrameStream, cleanup_images, composite_shard, image_folders, stream_images
+from .jobs import is_cancelled, mark_cancelled, running_stages, track_stage, untrack_stage
+from .pipeline import download_and_composite
 from .videos import build_slideshow
-from .utils import Mode, REDIS_HOST, REDIS_PORT, TRUE_HOST, year2dates
+from .utils import (
+    COMPOSITE_CACHE_QUALITY,
+    COMPOSITE_SHARDS,
+    DEFAULT_SHORT_SONG_PATH,
+    DEFAULT_SONG_PATH,
+    EXPORTS_PATH,
+    FRAME_MODE,
+    RENDER_ENGINE,
+    FrameMode,
+    IMAGE_QUALITY,
+    Mode,
+    REDIS_HOST,
+    REDIS_PORT,
+    RenderEngine,
+    STAGE_RETRIES,
+    TRUE_HOST,
+    year2dates,
+)
 from .send import sms
 from .logger import logger
 
+IO_QUEUE = "io"
+CPU_QUEUE = "cpu"
+
 
 def make_celery(app_name=__name__, broker=f"redis://{REDIS_HOST}:{REDIS_PORT}/0") -> Celery:
     """
     Create a celery instance.
     """
     celery = Celery(app_name, broker=broker, backend=broker)
+
+    # stages are long and acked late, so a worker process holds only the message it's running; the rest stay in the
+    # queue for other workers, and count towards its depth (see estimates.queue_wait)
+    celery.conf.update(worker_prefetch_multiplier=1)
     return celery
 
 
 bcelery = make_celery()
 
 
-@bcelery.task(time_limit=1200)
-def make_video(token: str, bereal_token: str, phone: str, year: str, song_path: str, mode: Mode) -> str:
+@worker_ready.connect
+def warm_caches(**_) -> None:
     """
-    Creating a video takes about ~15 min. This is a work-in-progress!
+    Analyze and encode the bundled songs before the first job arrives; most users pick one of them.
 
-    TODO(michaelfromyeg): handle errors more gracefully; better logging.
+    Beats are analyzed as far as any job could need, so every job with a bundled song finds them cached.
     """
-    logger.info("Starting make_video task; first, downloading images...")
+    preparations: list[Callable[[str], object]] = [find_beats, encode_audio]
 
-    sdate, edate = year2dates(year)
-    result = memories(phone, year, token, sdate, edate)
+    for song_path in [DEFAULT_SHORT_SONG_PATH, DEFAULT_SONG_PATH]:
+        for prepare in preparations:
+            try:
+                prepare(song_path)
+            except Exception as error:
+                logger.warning("Failed to %s %s ahead of time: %s", prepare.__name__, song_path, error)
 
-    if not result:
-        raise Exception("Could not generate memories; try again later")
+    return None
 
-    short_bereal_token = bereal_token[:10]
-    video_file = f"{short_bereal_token}-{phone}-{year}.mp4"
 
-    logger.info("Creating images for %s...", video_file)
-    try:
-        image_folder = create_images(phone, year)
-    except Exception as e:
-        logger.error("Failed to create images: %s", e)
-        gc.collect()
-        raise e
+@worker_process_init.connect
+def stop_ffmpeg_on_terminate(**_) -> None:
+    """
+    When a worker process is terminated (i.e., its task was revoked with terminate=True), stop its ffmpeg processes
+    too; otherwise, they'd be left to finish encoding a video no one will watch.
+    """
 
-    logger.info("Creating video %s from %s...", video_file, image_folder)
-    try:
-        build_slideshow(phone, year, image_folder, song_path, video_file, mode)
-    except Exception as e:
-        logger.error("Failed to build slideshow: %s", e)
+    def terminate(signum: int, _frame: Any) -> None:
+        stop_ffmpeg()
+
+        # then go down the way the process would have anyway
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, terminate)
+    return None
+
+
+class Stage(Task):
+    """
+    A stage of making a video.
+
+    The job's result lives under the id of the make_video task that started it, which the canvas hands to its last
+    stage; if an earlier stage fails, fail_job records that under the job's id too (see video_canvas).
+
+    A stage that raises (including when it hits its soft time limit) is retried, with backoff, up to STAGE_RETRIES
+    times. Its message is only acknowledged once it's done, so if its worker dies (e.g., runs out of memory), it's
+    delivered again; its checkpoint counts those attempts too, so a stage that always kills its worker still fails
+    eventually. A stage that hits its hard time limit isn't retried; it just fails.
+
+    A stage of a cancelled job is skipped, which stops the rest of the canvas, too; while it runs, it's tracked, so
+    cancel_job can terminate it. A stage that finishes records how long it took (see estimates.py).
+    """
+
+    autoretry_for = (Exception,)
+    dont_autoretry_for = (TooManyAttempts,)
+    max_retries = STAGE_RETRIES
+    retry_backoff = True
+    acks_late = True
+    reject_on_worker_lost = True
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        job_id = kwargs.get("job_id")
+
+        if job_id is not None and is_cancelled(job_id):
+            logger.info("Skipping %s; job %s was cancelled", self.name, job_id)
+            raise Ignore()
+
+        if job_id is not None:
+            track_stage(job_id, self.request.id)
+
+        start = perf_counter()
+        try:
+            # not super().__call__, which would push a request of its own and make the stage look like it was called
+            # directly, outside of a worker; then it couldn't be retried
+            result = self.run(*args, **kwargs)
+        finally:
+            if job_id is not None:
+                untrack_stage(job_id, self.request.id)
+
+        # how long the stages in each queue take is how long a new job's stages will wait behind them
+        record_queue_duration(self.queue, perf_counter() - start)
+
+        return result
+
+    def on_failure(self, exc: Exception, task_id: str, args: Any, kwargs: Any, einfo: Any) -> None:
         gc.collect()
-        raise e
+        return None
+
+
+def streams_frames() -> bool:
+    """
+    Whether frames are composited as the encoder needs them, in the render stage, rather than in their own stage.
+    """
+    return FRAME_MODE == FrameMode.MEMORY and RENDER_ENGINE == RenderEngine.MOVIEPY
 
-    video_url = f"{TRUE_HOST}/video/{video_file}?phone={phone}&berealToken={bereal_token}"
-    sms(f"+{phone}", video_url)
+
+@bcelery.task(base=Stage, queue=IO_QUEUE, soft_time_limit=540, time_limit=600)
+def download_stage(phone: str, year: str, token: str, preview: bool = False, job_id: str | None = None) -> None:
+    """
+    Download a user's memories for the year, compositing each day into the composite cache as soon as it's on disk.
+    """
+    sdate, edate = year2dates(year)
+
+    # at the quality whichever stage composites next will look them up at
+    quality = COMPOSITE_CACHE_QUALITY if streams_frames() else IMAGE_QUALITY
+
+    def download() -> list[str]:
+        if not download_and_composite(phone, year, token, sdate, edate, preview=preview, quality=quality):
+            raise Exception("Could not generate memories; try again later")
+
+        primary_folder, secondary_folder, _ = image_folders(phone, year, preview)
+        outputs = [folder for folder in [primary_folder, secondary_folder] if folder is not None]
+
+        # with nothing to show for it, there's no video to make; retrying fetches a fresh feed (see memories)
+        if count_days(phone, year, preview) == 0:
+            raise Exception("None of the memories could be downloaded; try again later")
+
+        # make do without the images that failed, but have the next job try them again
+        if failed := failed_downloads(phone, year, sdate, edate, preview):
+            raise Incomplete(f"{len(failed)} images failed to download", outputs)
+
+        return outputs
+
+    checkpointed(
+        phone,
+        year,
+        stage_name("download", preview),
+        download_inputs(phone, year, preview),
+        timed("download", download, lambda: count_days(phone, year, preview), preview),
+        max_attempts=STAGE_RETRIES + 1,
+        # always look for new memories (or a fresh feed, after logging in again); what's already on disk is reused
+        force=True,
+        job_id=job_id,
+    )
+    return None
+
+
+@bcelery.task(base=Stage, queue=CPU_QUEUE, soft_time_limit=540, time_limit=600)
+def composite_stage(
+    phone: str, year: str, shard: int, shards: int, preview: bool = False, job_id: str | None = None
+) -> None:
+    """
+    Composite one shard of a user's downloaded memories.
+    """
+    checkpointed(
+        phone,
+        year,
+        stage_name(f"composite-{shard}-of-{shards}", preview),
+        composite_inputs(phone, year, shard, shards, preview),
+        timed(
+            "composite",
+            lambda: [composite_shard(phone, year, shard, shards, preview=preview)],
+            lambda: len(range(shard, count_days(phone, year, preview), shards)),
+            preview,
+        ),
+        max_attempts=STAGE_RETRIES + 1,
+        job_id=job_id,
+    )
+    return None
+
+
+@bcelery.task(base=Stage, queue=CPU_QUEUE, soft_time_limit=1140, time_limit=1200)
+def render_stage(
+    phone: str,
+    year: str,
+    song_path: str,
+    video_file: str,
+    mode: Mode,
+    preview: bool = False,
+    job_id: str | None = None,
+) -> str:
+    """
+    Render the video from the composited images (or, when streaming frames, from the downloaded ones).
+    """
+
+    def render() -> list[str]:
+        images: str | FrameStream
+        if streams_frames():
+            images = stream_images(phone, year, preview=preview)
+        else:
+            _, _, images = image_folders(phone, year, preview)
+
+        logger.info("Creating video %s from %s...", video_file, images)
+        build_slideshow(phone, year, images, song_path, video_file, mode, preview=preview)
+
+        return [os.path.join(EXPORTS_PATH, video_file)]
+
+    checkpointed(
+        phone,
+        year,
+        stage_name("render", preview),
+        render_inputs(phone, year, song_path, video_file, mode, preview),
+        timed("render", render, lambda: count_days(phone, year, preview), preview, mode),
+        max_attempts=STAGE_RETRIES + 1,
+        job_id=job_id,
+    )
+    return video_file
+
+
+@bcelery.task(base=Stage, queue=IO_QUEUE, soft_time_limit=50, time_limit=60)
+def notify_stage(
+    phone: str, year: str, bereal_token: str, video_file: str, preview: bool = False, job_id: str | None = None
+) -> str:
+    """
+    Text the user a link to their video, and clean up after the job.
+    """
+    # the user is still on the page for a preview; only text them the real thing
+    if not preview:
+        video_url = f"{TRUE_HOST}/video/{video_file}?phone={phone}&berealToken={bereal_token}"
+        sms(f"+{phone}", video_url)
 
     logger.info("Cleaning up images")
     try:
-        cleanup_images(phone, year)
+        clear_checkpoints(phone, year, preview=preview)
+        cleanup_images(phone, year, preview=preview)
     except Exception as e:
         logger.error("Failed to clean up images: %s", e)
         pass
 
     logger.info("Returning %s...", video_file)
     return video_file
+
+
+@bcelery.task(queue=IO_QUEUE)
+def fail_job(request: Any, exc: BaseException, traceback: str | None, job_id: str) -> None:
+    """
+    Record that a job failed, under its own id, when one of its stages does.
+
+    This is every stage's errback, rather than part of Stage.on_failure, because a stage that hits its hard time limit
+    is failed by the worker without running any of its own code; the job would look pending forever.
+    """
+    if request.id != job_id:
+        bcelery.backend.mark_as_failure(job_id, exc, traceback)
+
+    return None
+
+
+def video_canvas(
+    job_id: str,
+    token: str,
+    bereal_token: str,
+    phone: str,
+    year: str,
+    song_path: str,
+    mode: Mode,
+    video_file: str,
+    preview: bool = False,
+) -> Signature:
+    """
+    The stages of making a video: download, then composite, in COMPOSITE_SHARDS shards at once, then render, then
+    notify. Every stage's arguments are fixed up front, so none of them depend on another's result.
+    """
+    download = download_stage.si(phone, year, token, preview, job_id=job_id)
+    render = render_stage.si(phone, year, song_path, video_file, mode, preview, job_id=job_id)
+    notify = notify_stage.si(phone, year, bereal_token, video_file, preview, job_id=job_id)
+    shards = [
+        composite_stage.si(phone, year, shard, COMPOSITE_SHARDS, preview, job_id=job_id)
+        for shard in range(COMPOSITE_SHARDS)
+    ]
+
+    for stage in [download, render, notify, *shards]:
+        stage.link_error(fail_job.s(job_id=job_id))
+
+    if streams_frames():
+        return chain(download, render, notify)
+
+    return chain(download, chord(group(shards), render), notify)
+
+
+def video_filename(bereal_token: str, phone: str, year: str, preview: bool = False, key: str | None = None) -> str:
+    """
+    The name of a user's video, in EXPORTS_PATH.
+
+    If given, part of the job's key (see job_key) goes in the name too, so that videos of the same year with different
+    songs or modes don't overwrite each other.
+    """
+    short_bereal_token = bereal_token[:10]
+    short_key = f"-{key.removeprefix('job:')[:12]}" if key is not None else ""
+    return f"{short_bereal_token}-{phone}-{year}{short_key}{'-preview' if preview else ''}.mp4"
+
+
+def cancel_job(job_id: str) -> None:
+    """
+    Cancel a job: its stages that haven't started are skipped, and the ones that are running are terminated.
+    """
+    logger.info("Cancelling job %s", job_id)
+
+    mark_cancelled(job_id)
+    bcelery.control.revoke([job_id, *running_stages(job_id)], terminate=True, signal="SIGTERM")
+
+    # nothing else will record what happened to the job
+    bcelery.backend.mark_as_revoked(job_id, reason="cancelled")
+
+    return None
+
+
+@bcelery.task(bind=True, queue=IO_QUEUE)
+def make_video(
+    self: Task,
+    token: str,
+    bereal_token: str,
+    phone: str,
+    year: str,
+    song_path: str,
+    mode: Mode,
+    preview: bool = False,
+    key: str | None = None,
+) -> str:
+    """
+    Creating a video takes about ~15 min. This is a work-in-progress!
+
+    A preview, built from thumbnails, takes seconds; it's meant to be shown while the full video renders.
+
+    This task only kicks off the stages; it's replaced by them, so its result is the last stage's (the video's file
+    name) once they're done. The job's key, if given, is part of that name.
+    """
+    video_file = video_filename(bereal_token, phone, year, preview, key)
+
+    logger.info("Starting make_video task for %s...", video_file)
+
+    canvas = video_canvas(self.request.id, token, bereal_token, phone, year, song_path, mode, video_file, preview)
+    raise self.replace(canvas)
@@ -0,0 +1,241 @@
+"""
+Checkpoints for the stages of making a video, so a job that's retried (or resumed from the CLI) picks up after the
+last stage it finished, instead of downloading and compositing everything again.
+
+A stage's checkpoint records a hash of its inputs, how many times it's been started, and, once it's done, its outputs.
+It only counts as done if its inputs haven't changed and its outputs are all still on disk. Checkpoints live with the
+job's content, in content/<phone>/<year>/.checkpoints, so they're cleaned up with it.
+"""
+
+import json
+import os
+from collections.abc import Callable
+from datetime import datetime
+from typing import Literal, TypedDict
+
+from .beats import song_digest
+from .bereal import manifest_path
+from .cache import hash_file, make_key
+from .images import COMPOSITE_VERSION
+from .logger import logger
+from .utils import (
+    CONTENT_PATH,
+    ENDCARD_DURATION,
+    INTRO_DURATION,
+    PREVIEW_RENDER_SIZE,
+    RENDER_ENGINE,
+    RENDER_SIZE,
+    Mode,
+    write_json,
+)
+
+CHECKPOINT_FOLDER = ".checkpoints"
+
+
+class Checkpoint(TypedDict):
+    """
+    The progress of a single stage of a job, as stored in its checkpoint file.
+    """
+
+    stage: str
+    inputs: str
+    job: str | None
+    status: Literal["running", "done"]
+    attempts: int
+    outputs: list[str]
+    updated_at: str
+
+
+class Incomplete(Exception):
+    """
+    A stage did what it could, and its outputs are usable, but it should be run again next time; e.g., some of the
+    images failed to download.
+    """
+
+    def __init__(self, message: str, outputs: list[str]) -> None:
+        super().__init__(message)
+        self.outputs = outputs
+
+
+class TooManyAttempts(Exception):
+    """
+    A stage has been started more times than it's allowed; e.g., it keeps getting its worker killed.
+    """
+
+
+def checkpoint_folder(phone: str, year: str) -> str:
+    """
+    Where the checkpoints of a user's year live.
+    """
+    return os.path.join(CONTENT_PATH, phone, year, CHECKPOINT_FOLDER)
+
+
+def checkpoint_path(phone: str, year: str, stage: str) -> str:
+    """
+    Where the checkpoint of a single stage lives.
+    """
+    return os.path.join(checkpoint_folder(phone, year), f"{stage}.json")
+
+
+def stage_name(stage: str, preview: bool = False) -> str:
+    """
+    The name of a stage's checkpoint; a preview's stages are checkpointed separately from the full video's.
+    """
+    return f"{stage}-preview" if preview else stage
+
+
+def manifest_digest(phone: str, year: str, preview: bool = False) -> str:
+    """
+    The hash of a year's download manifest, or "" if there isn't one; stages after the download depend on it.
+    """
+    path = manifest_path(os.path.join(CONTENT_PATH, phone, year), preview)
+
+    if not os.path.isfile(path):
+        return ""
+
+    return hash_file(path)
+
+
+def load_checkpoint(phone: str, year: str, stage: str) -> Checkpoint | None:
+    """
+    Load a stage's checkpoint, if it has one.
+    """
+    path = checkpoint_path(phone, year, stage)
+
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except (OSError, json.JSONDecodeError) as error:
+        logger.warning("Ignoring unreadable checkpoint %s: %s", path, error)
+        return None
+
+
+def save_checkpoint(phone: str, year: str, checkpoint: Checkpoint) -> None:
+    """
+    Atomically write a stage's checkpoint.
+    """
+    os.makedirs(checkpoint_folder(phone, year), exist_ok=True)
+    write_json(checkpoint_path(phone, year, checkpoint["stage"]), checkpoint)
+
+
+def completed(phone: str, year: str, stage: str, inputs: str) -> Checkpoint | None:
+    """
+    The stage's checkpoint if it's done, with these inputs, and its outputs are still around; None otherwise.
+    """
+    checkpoint = load_checkpoint(phone, year, stage)
+
+    if checkpoint is None or checkpoint["status"] != "done" or checkpoint["inputs"] != inputs:
+        return None
+
+    if not all(os.path.exists(output) for output in checkpoint["outputs"]):
+        logger.info("The outputs of stage %s are gone; running it again", stage)
+        return None
+
+    return checkpoint
+
+
+def checkpointed(
+    phone: str,
+    year: str,
+    stage: str,
+    inputs: str,
+    run: Callable[[], list[str]],
+    max_attempts: int | None = None,
+    force: bool = False,
+    job_id: str | None = None,
+) -> list[str]:
+    """
+    Run a stage, unless it's already done with the same inputs (or forced to), and return its outputs (paths on disk).
+
+    If given, raise TooManyAttempts instead of starting a stage for more than the max_attempts-th time. Attempts are
+    counted per job; a new job starts counting again, even if an earlier one gave up on the same stage.
+
+    A stage that raises Incomplete isn't marked as done, but its outputs are returned all the same.
+    """
+    if not force and (done := completed(phone, year, stage, inputs)) is not None:
+        logger.info("Stage %s is already done; skipping it", stage)
+        return done["outputs"]
+
+    previous = load_checkpoint(phone, year, stage)
+    attempts = 1
+    if previous is not None and previous["inputs"] == inputs and previous.get("job") == job_id:
+        attempts = previous["attempts"] + 1
+
+    if max_attempts is not None and attempts > max_attempts:
+        raise TooManyAttempts(f"Stage {stage} was started {attempts - 1} times without finishing")
+
+    checkpoint: Checkpoint = {
+        "stage": stage,
+        "inputs": inputs,
+        "job": job_id,
+        "status": "running",
+        "attempts": attempts,
+        "outputs": [],
+        "updated_at": datetime.now().isoformat(),
+    }
+    save_checkpoint(phone, year, checkpoint)
+
+    logger.info("Starting stage %s (attempt %d)", stage, attempts)
+    try:
+        outputs = run()
+    except Incomplete as incomplete:
+        logger.warning("Stage %s is incomplete: %s", stage, incomplete)
+        return incomplete.outputs
+
+    checkpoint["status"] = "done"
+    checkpoint["outputs"] = outputs
+    checkpoint["updated_at"] = datetime.now().isoformat()
+    save_checkpoint(phone, year, checkpoint)
+
+    return outputs
+
+
+def download_inputs(phone: str, year: str, preview: bool = False) -> str:
+    """
+    The inputs of downloading a user's year. The token isn't one of them; a new one fetches the same memories.
+    """
+    return make_key("download", phone, year, preview)
+
+
+def composite_inputs(phone: str, year: str, shard: int, shards: int, preview: bool = False) -> str:
+    """
+    The inputs of compositing one shard of a user's year.
+    """
+    size = PREVIEW_RENDER_SIZE if preview else RENDER_SIZE
+    return make_key("composite", manifest_digest(phone, year, preview), shard, shards, size, COMPOSITE_VERSION)
+
+
+def render_inputs(phone: str, year: str, song_path: str, video_file: str, mode: Mode, preview: bool = False) -> str:
+    """
+    The inputs of rendering a user's video.
+    """
+    return make_key(
+        "render",
+        manifest_digest(phone, year, preview),
+        song_digest(song_path),
+        video_file,
+        mode,
+        preview,
+        RENDER_ENGINE,
+        INTRO_DURATION,
+        ENDCARD_DURATION,
+    )
+
+
+def clear_checkpoints(phone: str, year: str, preview: bool = False) -> None:
+    """
+    Delete the checkpoints of a job that's finished (only the preview's, for a preview).
+    """
+    folder = checkpoint_folder(phone, year)
+
+    if not os.path.isdir(folder):
+        return None
+
+    for filename in os.listdir(folder):
+        if filename.removesuffix(".json").endswith("-preview") == preview:
+            os.remove(os.path.join(folder, filename))
+
+    return None
@@ -8,14 +8,38 @@ import shutil
 from time import sleep
 from typing import Any, Callable
 
-from .bereal import memories, send_code, verify_code
-from .images import create_images, cleanup_images
+from .bereal import failed_downloads, memories, send_code, verify_code
+from .checkpoints import (
+    Incomplete,
+    checkpointed,
+    clear_checkpoints,
+    composite_inputs,
+    download_inputs,
+    render_inputs,
+    stage_name,
+)
+from .images import FrameStream, cleanup_images, create_images, image_folders, stream_images
 from .logger import logger
-from .utils import CONTENT_PATH, YEARS, Mode, str2mode, year2dates
+from .utils import (
+    COMPOSITE_WORKERS,
+    CONTENT_PATH,
+    EXPORTS_PATH,
+    FRAME_MODE,
+    RENDER_ENGINE,
+    YEARS,
+    FrameMode,
+    Mode,
+    RenderEngine,
+    str2mode,
+    year2dates,
+)
 from .videos import build_slideshow
 
 STEPS = 5
 
+# the first step that doesn't need any input from the user; resuming starts here
+RESUME_STEP = 2
+
 
 def ask(question: str, validate: Callable[[str], bool], error: str, retries: int = 10) -> str:
     """
@@ -169,33 +193,99 @@ def step(idx: int, retval: dict[str, Any] | None) -> dict[str, Any] | None:
                 print("Invalid parameters; exiting...")
                 return None
 
-            result = memories(retval["phone"], retval["year"], retval["token"], retval["sdate"], retval["edate"])
-            if not result:
+            def download() -> list[str]:
+                result = memories(
+                    retval["phone"],
+                    retval["year"],
+                    retval["token"],
+                    retval["sdate"],
+                    retval["edate"],
+                    refresh_feed=retval["refresh_feed"],
+                    preview=retval["preview"],
+                )
+                if not result:
+                    raise Exception("Failed to download memories")
+
+                primary_folder, secondary_folder, _ = image_folders(retval["phone"], retval["year"], retval["preview"])
+                outputs = [folder for folder in [primary_folder, secondary_folder] if folder is not None]
+
+                # make do without the images that failed, but have --resume try them again
+                if failed := failed_downloads(
+                    retval["phone"], retval["year"], retval["sdate"], retval["edate"], retval["preview"]
+                ):
+                    raise Incomplete(f"{len(failed)} images failed to download", outputs)
+
+                return outputs
+
+            try:
+                checkpointed(
+                    retval["phone"],
+                    retval["year"],
+                    stage_name("download", retval["preview"]),
+                    download_inputs(retval["phone"], retval["year"], retval["preview"]),
+                    download,
+                    force=not retval["resume"],
+                )
+            except Exception:
                 print("Failed to download memories; exiting...")
                 return None
         case 3:
-            image_folder = create_images(retval["phone"], retval["year"])
-
-            retval["image_folder"] = image_folder
+            images: str | FrameStream
+            # the ffmpeg engine reads its images from disk
+            if retval["frame_mode"] == FrameMode.MEMORY and RENDER_ENGINE == RenderEngine.MOVIEPY:
+                images = stream_images(
+                    retval["phone"], retval["year"], preview=retval["preview"], workers=retval["workers"]
+                )
+            else:
+                [images] = checkpointed(
+                    retval["phone"],
+                    retval["year"],
+                    stage_name("composite-0-of-1", retval["preview"]),
+                    composite_inputs(retval["phone"], retval["year"], 0, 1, retval["preview"]),
+                    lambda: [
+                        create_images(
+                            retval["phone"], retval["year"], preview=retval["preview"], workers=retval["workers"]
+                        )
+                    ],
+                    force=not retval["resume"],
+                )
+
+            retval["images"] = images
         case 4:
             if retval["mode"] is None:
                 print("Invalid parameters; exiting...")
                 return None
 
             short_token = retval["token"][:10]
-            video_file = f"{short_token}-{retval['phone']}-{retval['year']}.mp4"
-
-            build_slideshow(
-                phone=retval["phone"],
-                year=retval["year"],
-                image_folder=retval["image_folder"],
-                song_path=retval["song_path"],
-                filename=video_file,
-                mode=retval["mode"],
+            suffix = "-preview" if retval["preview"] else ""
+            video_file = f"{short_token}-{retval['phone']}-{retval['year']}{suffix}.mp4"
+
+            def render() -> list[str]:
+                build_slideshow(
+                    phone=retval["phone"],
+                    year=retval["year"],
+                    images=retval["images"],
+                    song_path=retval["song_path"],
+                    filename=video_file,
+                    mode=retval["mode"],
+                    preview=retval["preview"],
+                )
+                return [os.path.join(EXPORTS_PATH, video_file)]
+
+            checkpointed(
+                retval["phone"],
+                retval["year"],
+                stage_name("render", retval["preview"]),
+                render_inputs(
+                    retval["phone"], retval["year"], retval["song_path"], video_file, retval["mode"], retval["preview"]
+                ),
+                render,
+                force=not retval["resume"],
             )
 
             # TODO(michaelfromyeg): delete images in production
-            cleanup_images(retval["phone"], retval["year"])
+            clear_checkpoints(retval["phone"], retval["year"], preview=retval["preview"])
+            cleanup_images(retval["phone"], retval["year"], preview=retval["preview"])
         case _:
             raise ValueError(f"Invalid step: {idx}")
 
@@ -210,6 +300,13 @@ def cli(args: argparse.Namespace) -> None:
 
     idx = args.step
 
+    if args.resume:
+        if None in [args.phone, args.token, args.year, args.song_path, args.mode]:
+            print("Resuming needs --phone, --token, --year, --song_path, and --mode; exiting...")
+            return None
+
+        idx = max(idx, RESUME_STEP)
+
     retval: dict[str, Any] | None = {
         "phone": args.phone,
         "token": args.token,
@@ -218,8 +315,13 @@ def cli(args: argparse.Namespace) -> None:
         "song": args.song,
         "mode": str2mode(args.mode),
         "year": args.year,
-        "image_folder": args.image_folder,
+        "images": args.image_folder,
         "song_path": args.song_path,
+        "refresh_feed": args.refresh_feed,
+        "preview": args.preview,
+        "workers": args.workers,
+        "frame_mode": FrameMode(args.frame_mode),
+        "resume": args.resume,
     }
 
     if retval and args.year:
@@ -250,6 +352,25 @@ if __name__ == "__main__":
     parser.add_argument("--mode", type=str, default=None, help="The mode to use")
     parser.add_argument("--image_folder", type=str, default=None, help="The image folder to use")
     parser.add_argument("--song_path", type=str, default=None, help="The song path to use")
+    parser.add_argument(
+        "--refresh_feed", action="store_true", help="Ignore the cached memories feed and fetch it again"
+    )
+    parser.add_argument("--preview", action="store_true", help="Render a quick, low-resolution preview")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the steps already done by a previous run, as recorded in its checkpoints, instead of using --step",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=COMPOSITE_WORKERS, help="The number of threads to composite images with"
+    )
+    parser.add_argument(
+        "--frame_mode",
+        type=str,
+        default=FRAME_MODE,
+        choices=list(FrameMode),
+        help="Stream frames to the encoder ('memory') or write them to 'combined/' first ('disk')",
+    )
 
     args = parser.parse_args()
 
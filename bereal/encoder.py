@@ -0,0 +1,235 @@
+"""
+Encode a slideshow with ffmpeg directly, one frame per image.
+
+moviepy renders a slideshow at a constant frame rate, so every image is decoded, converted, and encoded once per
+1/24s it's on screen. Here, ffmpeg's concat demuxer is given each image once along with how long to show it, and the
+video is encoded with a variable frame rate; the work scales with the number of images, not the length of the video.
+
+x264 doesn't spread a single encode at these sizes over many cores well, so the images are split into segments that
+are encoded by separate ffmpeg processes at once. Each segment starts on an image boundary, and so on a keyframe, so
+they can be joined back together without re-encoding; the song, already encoded (see encode_audio), is copied in
+during that same final pass.
+"""
+
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+from .logger import logger
+from .utils import ENCODE_SEGMENTS
+
+Segment = tuple[str, float]
+"""
+An encoded video file, and how long it's meant to last.
+"""
+
+# images are demuxed at 25 fps by default, which would round every image's start to 40ms; this rounds it to 1ms
+IMAGE_FRAMERATE = 1000
+
+# the ffmpeg processes this process is waiting on, so they can be stopped along with it (see stop_ffmpeg)
+running: set[subprocess.Popen] = set()
+running_lock = threading.Lock()
+
+
+def ffmpeg(*args: str) -> None:
+    """
+    Run ffmpeg with the given arguments, logging its complaints if it fails.
+    """
+    command = [FFMPEG_BINARY, "-y", "-loglevel", "error", *args]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    with running_lock:
+        running.add(process)
+
+    try:
+        _, stderr = process.communicate()
+    except BaseException:
+        # e.g., the task hit its soft time limit; don't leave ffmpeg encoding on its own
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        with running_lock:
+            running.discard(process)
+
+    if process.returncode != 0:
+        logger.error("ffmpeg failed: %s", stderr)
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+
+    return None
+
+
+def stop_ffmpeg() -> None:
+    """
+    Kill every ffmpeg process this process is running.
+
+    Not SIGTERM, which ffmpeg takes as a cue to finish up; it can spend most of a minute flushing its encoder.
+    """
+    with running_lock:
+        processes = list(running)
+
+    for process in processes:
+        logger.info("Killing ffmpeg (pid %d)", process.pid)
+        process.kill()
+
+    return None
+
+
+def video_args(preview: bool = False) -> list[str]:
+    """
+    The video codec parameters; every segment of a video must share them to be joined without re-encoding.
+    """
+    return ["-c:v", "libx264", "-preset", "ultrafast" if preview else "medium", "-pix_fmt", "yuv420p"]
+
+
+def escape(path: str) -> str:
+    """
+    Quote a path for an ffconcat script.
+    """
+    return "'" + os.path.abspath(path).replace("'", "'\\''") + "'"
+
+
+def write_concat_list(
+    list_path: str, paths: list[str], durations: list[float] | None = None, options: dict[str, str] | None = None
+) -> None:
+    """
+    Write an ffconcat script that plays the files in order, each for its duration, if given.
+
+    Options are passed to the demuxer of every file.
+    """
+    with open(list_path, "w") as list_file:
+        list_file.write("ffconcat version 1.0\n")
+
+        for i, path in enumerate(paths):
+            list_file.write(f"file {escape(path)}\n")
+            list_file.writelines(f"option {key} {value}\n" for key, value in (options or {}).items())
+
+            if durations is not None and i < len(durations):
+                list_file.write(f"duration {durations[i]:.6f}\n")
+
+    return None
+
+
+def encode_video(
+    image_paths: list[str], durations: list[float], output_file: str, preview: bool = False, threads: int = 0
+) -> None:
+    """
+    Encode the images, each shown for its duration, into a silent video with a variable frame rate.
+
+    x264 picks its own number of threads unless given one.
+    """
+    # end on a one-tick copy of the last image; otherwise, the last frame only lasts a nominal tick, and the video is
+    # cut short by the rest of its duration (and the demuxer ignores the last entry's duration anyway)
+    tick = 1 / IMAGE_FRAMERATE
+    list_path = f"{output_file}.ffconcat"
+    write_concat_list(
+        list_path,
+        [*image_paths, image_paths[-1]],
+        [*durations[:-1], max(durations[-1] - tick, tick)],
+        {"framerate": str(IMAGE_FRAMERATE)},
+    )
+
+    try:
+        ffmpeg(
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-t",
+            f"{sum(durations):.6f}",
+            *video_args(preview),
+            "-threads",
+            str(threads),
+            "-fps_mode",
+            "vfr",
+            "-f",
+            "mp4",
+            output_file,
+        )
+    finally:
+        os.remove(list_path)
+
+    return None
+
+
+def encode_slideshow(
+    image_paths: list[str],
+    durations: list[float],
+    audio_file: str | None,
+    output_file: str,
+    preview: bool = False,
+    segments: int = ENCODE_SEGMENTS,
+    intro: Segment | None = None,
+    outro: Segment | None = None,
+) -> None:
+    """
+    Encode the images, each shown for its duration, in up to `segments` parallel pieces; then join them, between the
+    intro and outro (if any), and add the AAC audio track (if any), looped or cut to fit.
+
+    The intro and outro must have been encoded with the same video_args, at the same size, to be joined as-is.
+    """
+    start = perf_counter()
+    bounds = np.array_split(np.arange(len(image_paths)), max(1, min(segments, len(image_paths))))
+
+    with tempfile.TemporaryDirectory() as folder:
+        segment_paths = [os.path.join(folder, f"segment-{i}.mp4") for i in range(len(bounds))]
+
+        # share the cores out between the segments, rather than have every x264 assume it has them all
+        threads = max(1, (os.cpu_count() or 1) // len(bounds))
+
+        # each encode is its own process, so threads are enough to wait on them
+        with ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+            futures = [
+                pool.submit(
+                    encode_video,
+                    image_paths[indices[0] : indices[-1] + 1],
+                    durations[indices[0] : indices[-1] + 1],
+                    segment_path,
+                    preview,
+                    threads,
+                )
+                for indices, segment_path in zip(bounds, segment_paths)
+            ]
+
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # e.g., the task hit its soft time limit; leaving the pool would wait for every segment to be encoded
+                for future in futures:
+                    future.cancel()
+                stop_ffmpeg()
+                raise
+
+        parts: list[Segment] = [
+            (segment_path, sum(durations[i] for i in indices)) for indices, segment_path in zip(bounds, segment_paths)
+        ]
+        parts = [part for part in [intro, *parts, outro] if part is not None]
+
+        # give the join the exact lengths, rather than let it round them to the files' timebases
+        list_path = os.path.join(folder, "segments.ffconcat")
+        write_concat_list(list_path, [path for path, _ in parts], [duration for _, duration in parts])
+
+        args = ["-f", "concat", "-safe", "0", "-i", list_path]
+        if audio_file is not None:
+            args += ["-stream_loop", "-1", "-i", audio_file, "-map", "0:v", "-map", "1:a", "-c:a", "copy"]
+
+        total = sum(duration for _, duration in parts)
+        ffmpeg(*args, "-t", f"{total:.6f}", "-c:v", "copy", "-movflags", "+faststart", output_file)
+
+    logger.info(
+        "Encoded %d images in %d segments into %s in %.2fs",
+        len(image_paths),
+        len(bounds),
+        output_file,
+        perf_counter() - start,
+    )
+    return None
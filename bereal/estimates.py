@@ -0,0 +1,254 @@
+"""
+Estimate when a new video would start and finish, from how deep the queues are and how long stages have taken before.
+
+Every stage that runs records how long it took, and for how many images, in Redis; the last STATS_WINDOW of each
+stage (by mode, and preview or not) are fit with a line, so a stage's duration is predicted from the number of images
+it has to handle. Until there's enough history, a stage is assumed to take DEFAULT_SECONDS_PER_IMAGE per image.
+
+How long a new job waits to start is the work queued ahead of it: the number of messages waiting in each queue, times
+how long that queue's tasks have taken lately, spread over the queue's workers.
+"""
+
+import json
+import math
+import os
+from datetime import date, datetime, timedelta, timezone
+from time import perf_counter
+from typing import Callable, TypedDict, cast
+
+import numpy as np
+import redis
+
+from .images import image_folders, index_images
+from .jobs import JOB_TTL, jobs_redis
+from .utils import (
+    CPU_WORKERS,
+    IO_WORKERS,
+    MAX_QUEUE_WAIT,
+    REDIS_HOST,
+    REDIS_PORT,
+    STATS_WINDOW,
+    Mode,
+)
+
+# how many recent durations a prediction needs before it's trusted over the defaults
+MIN_SAMPLES = 3
+
+# a rough guess at each stage's cost per image, until there's history to go by
+DEFAULT_SECONDS_PER_IMAGE = {"download": 0.5, "composite": 1.0, "render": 1.0}
+
+# how long any queued task takes, until there's history to go by
+DEFAULT_TASK_SECONDS = 60.0
+
+# the broker's queues are lists, named after them, in database 0
+broker_redis = redis.Redis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}/0")
+
+
+class Estimate(TypedDict):
+    """
+    When a job is expected to start and finish (as ISO 8601 timestamps), and how long it's expected to wait in line.
+    """
+
+    start: str
+    finish: str
+    wait: float
+
+
+def stats_key(stage: str, preview: bool = False, mode: Mode | None = None) -> str:
+    """
+    The Redis list of a stage's recent durations; rendering depends on the mode, too.
+    """
+    return f"stats:{stage}:{mode or 'any'}:{'preview' if preview else 'full'}"
+
+
+def queue_stats_key(queue: str) -> str:
+    """
+    The Redis list of the recent durations of a queue's tasks, whatever they are.
+    """
+    return f"stats:queue:{queue}"
+
+
+def record_duration(stage: str, n_images: int, seconds: float, preview: bool = False, mode: Mode | None = None) -> None:
+    """
+    Record that a stage took `seconds` to handle `n_images` images.
+    """
+    name = stats_key(stage, preview, mode)
+
+    jobs_redis.lpush(name, json.dumps([n_images, seconds]))
+    jobs_redis.ltrim(name, 0, STATS_WINDOW - 1)
+
+    return None
+
+
+def record_queue_duration(queue: str, seconds: float) -> None:
+    """
+    Record that one of a queue's tasks took `seconds`.
+    """
+    name = queue_stats_key(queue)
+
+    jobs_redis.lpush(name, seconds)
+    jobs_redis.ltrim(name, 0, STATS_WINDOW - 1)
+
+    return None
+
+
+def timed(
+    stage: str,
+    run: Callable[[], list[str]],
+    n_images: Callable[[], int],
+    preview: bool = False,
+    mode: Mode | None = None,
+) -> Callable[[], list[str]]:
+    """
+    Wrap a stage's work so its duration is recorded when it's done, along with the number of images it handled.
+    """
+
+    def timed_run() -> list[str]:
+        start = perf_counter()
+        outputs = run()
+        record_duration(stage, n_images(), perf_counter() - start, preview, mode)
+
+        return outputs
+
+    return timed_run
+
+
+def predict(stage: str, n_images: int, preview: bool = False, mode: Mode | None = None) -> float:
+    """
+    How long a stage is expected to take for `n_images` images, in seconds.
+    """
+    raw_samples = cast(list[bytes], jobs_redis.lrange(stats_key(stage, preview, mode), 0, -1))
+    samples = np.array([json.loads(raw) for raw in raw_samples], dtype=np.float64).reshape(-1, 2)
+
+    if len(samples) < MIN_SAMPLES:
+        return DEFAULT_SECONDS_PER_IMAGE[stage] * n_images
+
+    counts, seconds = samples[:, 0], samples[:, 1]
+
+    # with only one image count to go by (or a line that slopes down), assume the time is all per image
+    if len(np.unique(counts)) < 2 or (slope := np.polyfit(counts, seconds, 1)[0]) <= 0:
+        return float(seconds.sum() / max(counts.sum(), 1) * n_images)
+
+    intercept = seconds.mean() - slope * counts.mean()
+    return max(0.0, float(intercept + slope * n_images))
+
+
+def mean_task_duration(queue: str) -> float:
+    """
+    How long a queue's tasks have taken lately, on average, in seconds.
+    """
+    raw_samples = cast(list[bytes], jobs_redis.lrange(queue_stats_key(queue), 0, -1))
+
+    if len(raw_samples) < MIN_SAMPLES:
+        return DEFAULT_TASK_SECONDS
+
+    return float(np.mean([float(raw) for raw in raw_samples]))
+
+
+def queue_wait(queue: str, workers: int) -> float:
+    """
+    How long the tasks already in a queue will take its workers to get through, in seconds.
+
+    Workers don't prefetch (see celery.make_celery), so every task that hasn't started yet is still in the list.
+    """
+    depth = cast(int, broker_redis.llen(queue))
+    return depth * mean_task_duration(queue) / max(workers, 1)
+
+
+def count_days(phone: str, year: str, preview: bool = False) -> int:
+    """
+    The number of days a user's downloaded memories cover.
+    """
+    primary_folder, _, _ = image_folders(phone, year, preview)
+
+    if not os.path.isdir(primary_folder):
+        return 0
+
+    return len(index_images(primary_folder))
+
+
+def expected_images(phone: str, year: str, preview: bool = False) -> int:
+    """
+    How many images a user's video is expected to have: as many as they've downloaded already, if they have, or else
+    one for every day of the year (so far).
+    """
+    if (n_images := count_days(phone, year, preview)) > 0:
+        return n_images
+
+    start, end = date(int(year), 1, 1), min(date(int(year), 12, 31), date.today())
+    return max((end - start).days + 1, 1)
+
+
+def estimate_job(
+    phone: str,
+    year: str,
+    mode: Mode,
+    preview: bool,
+    io_queue: str,
+    cpu_queue: str,
+    shards: int,
+) -> Estimate:
+    """
+    Estimate when a new job would start and finish, if it were queued now; its download waits for the io queue, and
+    its compositing (in `shards` shards; none if frames are streamed) and rendering wait for the cpu queue.
+    """
+    n_images = expected_images(phone, year, preview)
+
+    download = predict("download", n_images, preview)
+    render = predict("render", n_images, preview, mode)
+
+    composite = 0.0
+    if shards > 0:
+        # the shards run at once, as far as there are workers for them
+        composite = math.ceil(shards / max(CPU_WORKERS, 1)) * predict(
+            "composite", math.ceil(n_images / shards), preview
+        )
+
+    now = datetime.now(timezone.utc)
+    start = now + timedelta(seconds=queue_wait(io_queue, IO_WORKERS))
+
+    # the cpu queue may have emptied out by the time the download is done
+    cpu_start = max(start + timedelta(seconds=download), now + timedelta(seconds=queue_wait(cpu_queue, CPU_WORKERS)))
+    finish = cpu_start + timedelta(seconds=composite + render)
+
+    wait = (start - now) + (cpu_start - start - timedelta(seconds=download))
+
+    return {"start": start.isoformat(), "finish": finish.isoformat(), "wait": wait.total_seconds()}
+
+
+def retry_after(estimate: Estimate) -> int | None:
+    """
+    If a job with this estimate would wait too long (i.e., more than MAX_QUEUE_WAIT), how many seconds to wait before
+    trying again; None if it can be queued now.
+    """
+    if estimate["wait"] <= MAX_QUEUE_WAIT:
+        return None
+
+    return max(60, math.ceil(estimate["wait"] - MAX_QUEUE_WAIT))
+
+
+def estimate_key(task_id: str) -> str:
+    """
+    The Redis key of a job's estimate.
+    """
+    return f"job:{task_id}:estimate"
+
+
+def save_estimate(task_id: str, estimate: Estimate) -> None:
+    """
+    Keep a job's estimate around, to report along with its status.
+    """
+    jobs_redis.set(estimate_key(task_id), json.dumps(estimate), ex=JOB_TTL)
+    return None
+
+
+def load_estimate(task_id: str) -> Estimate | None:
+    """
+    A job's estimate, if it has one.
+    """
+    raw = cast(bytes | None, jobs_redis.get(estimate_key(task_id)))
+
+    if raw is None:
+        return None
+
+    return json.loads(raw)
@@ -4,156 +4,555 @@ Combine two images together, with the secondary image in the top-left corner of
 
 import os
 import shutil
-
+import threading
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import TypedDict
+
+import numpy as np
 from PIL import Image, ImageChops, ImageDraw, ImageFont
 
+from .bereal import ManifestEntry, MediaKind, is_downloaded, load_manifest
+from .cache import DiskCache, hash_file, make_key
 from .logger import logger
-from .utils import CONTENT_PATH, FONT_BASE_PATH, OUTLINE_PATH, IMAGE_QUALITY
+from .utils import (
+    CACHE_PATH,
+    COMPOSITE_CACHE_MB,
+    COMPOSITE_CACHE_QUALITY,
+    COMPOSITE_WORKERS,
+    CONTENT_PATH,
+    FONT_BASE_PATH,
+    FRAME_BUFFER,
+    IMAGE_QUALITY,
+    OUTLINE_PATH,
+    PREVIEW_RENDER_SIZE,
+    RENDER_SIZE,
+)
+
+# the width that the label and inset layout were designed at, i.e., that of BeReal's full-size images
+REFERENCE_WIDTH = 1500
+
+# how much larger than the target an image may stay before resampling; higher is sharper, lower is faster
+REDUCING_GAP = 3.0
+
+COMPOSITE_VERSION = 1
+
+
+class PairingReport(TypedDict):
+    """
+    How well a year's primary and secondary images lined up, by day.
+    """
+
+    paired: int
+    missing_primary: list[str]
+    missing_secondary: list[str]
+
+
+ImagePair = tuple[str, str, str | None]
+"""
+A day's date label, its primary image path, and its secondary image path (None for previews).
+"""
+
+
+def index_images(folder: str) -> dict[str, str]:
+    """
+    Map each date prefix (i.e., 'YYYY-MM-DD') to the first image in the folder with that prefix.
+    """
+    index: dict[str, str] = {}
+
+    for filename in sorted(os.listdir(folder)):
+        index.setdefault(filename.split("_")[0], os.path.join(folder, filename))
+
+    return index
+
+
+def index_manifest(year_path: str, manifest: dict[str, ManifestEntry], kind: MediaKind) -> dict[str, str]:
+    """
+    Like index_images, but built from the download manifest rather than the directory listing.
+    """
+    index: dict[str, str] = {}
+
+    for entry in sorted(manifest.values(), key=lambda entry: entry["path"]):
+        if entry["kind"] == kind and is_downloaded(year_path, entry):
+            index.setdefault(entry["memoryDay"], os.path.join(year_path, entry["path"]))
+
+    return index
+
+
+def index_digests(year_path: str, preview: bool = False) -> dict[str, str]:
+    """
+    Map the path of every downloaded image to the SHA-256 of its contents, as recorded in the download manifest.
+    """
+    return {
+        os.path.join(year_path, entry["path"]): entry["sha256"]
+        for entry in load_manifest(year_path, preview).values()
+        if is_downloaded(year_path, entry) and entry["sha256"]
+    }
+
 
+def pair_images(
+    year_path: str, primary_folder: str, secondary_folder: str | None
+) -> tuple[list[ImagePair], PairingReport]:
+    """
+    Pair every day's primary image with its secondary image, once, up front.
 
-def process_image(
-    primary_filename: str,
-    primary_folder: str,
-    secondary_folder: str,
-    output_folder: str,
-) -> None:
+    Prefer the download manifest, which avoids listing the folders at all; fall back to the directory contents for
+    images that didn't come from 'memories' (e.g., copied in by hand).
+    """
+    # only a preview has no secondary images, and it keeps a manifest of its own
+    preview = secondary_folder is None
+    manifest = load_manifest(year_path, preview)
+    primary_kind: MediaKind = "thumbnail" if preview else "primary"
+
+    if manifest:
+        primaries = index_manifest(year_path, manifest, primary_kind)
+        secondaries = index_manifest(year_path, manifest, "secondary") if secondary_folder is not None else {}
+    else:
+        primaries = index_images(primary_folder)
+        secondaries = index_images(secondary_folder) if secondary_folder is not None else {}
+
+    if secondary_folder is None:
+        pairs: list[ImagePair] = [(day, primary_path, None) for day, primary_path in sorted(primaries.items())]
+        return pairs, {"paired": len(pairs), "missing_primary": [], "missing_secondary": []}
+
+    pairs = [
+        (day, primary_path, secondaries[day]) for day, primary_path in sorted(primaries.items()) if day in secondaries
+    ]
+    report: PairingReport = {
+        "paired": len(pairs),
+        "missing_primary": sorted(set(secondaries) - set(primaries)),
+        "missing_secondary": sorted(set(primaries) - set(secondaries)),
+    }
+
+    return pairs, report
+
+
+def log_pairing_report(report: PairingReport) -> None:
     """
-    Combine the primary image with the secondary image, and save the result in the output folder.
+    Summarize a pairing report in the logs; unmatched days are skipped, so call them out.
+    """
+    logger.info("Paired %d days", report["paired"])
+
+    if report["missing_secondary"]:
+        logger.warning("Skipping days without a secondary image: %s", ", ".join(report["missing_secondary"]))
+
+    if report["missing_primary"]:
+        logger.warning("Skipping days without a primary image: %s", ", ".join(report["missing_primary"]))
+
+
+def load_image(path: str, size: tuple[int, int]) -> Image.Image:
     """
-    font_size = 50
-    offset = 50
-    text_opacity = 150
+    Load an image as RGB(A), scaled and center-cropped to exactly the given size.
+
+    JPEGs are decoded straight at the smallest DCT scale that still covers the size, and everything else is reduced
+    by an integer factor before resampling, so the full-resolution pixels are never needed.
+    """
+    image = Image.open(path)
+    image.draft("RGB", size)
+
+    # crop to the target aspect ratio, like ImageOps.fit, but let resize() reduce first
+    width, height = image.size
+    target_ratio = size[0] / size[1]
+
+    box: tuple[float, float, float, float]
+    if width / height > target_ratio:
+        crop_width = height * target_ratio
+        box = ((width - crop_width) / 2, 0, (width + crop_width) / 2, height)
+    else:
+        crop_height = width / target_ratio
+        box = (0, (height - crop_height) / 2, width, (height + crop_height) / 2)
+
+    mode = "RGBA" if image.mode in ["RGBA", "LA", "P"] else "RGB"
+    return image.convert(mode).resize(size, Image.Resampling.BICUBIC, box=box, reducing_gap=REDUCING_GAP)
+
+
+class Compositor:
+    """
+    Combine primary and secondary images, with the secondary image in the top-left corner.
+
+    Every composite is exactly `size` pixels, whatever size its images came in at. The outline and font are loaded
+    once, and the outline is resized once, so each frame only pays for decoding, drawing, and encoding its own images.
+
+    Given a cache, composites are looked up by the contents of their images and everything else that affects their
+    pixels, and only composited on a miss.
+    """
+
+    def __init__(
+        self, size: tuple[int, int] = RENDER_SIZE, quality: int = IMAGE_QUALITY, cache: DiskCache | None = None
+    ) -> None:
+        self.size = size
+        self.secondary_size = (size[0] // 3, size[1] // 3)
+        self.quality = quality
+        self.text_opacity = 150
+
+        # the label's layout was designed for full-size (1500px wide) images; scale it to match
+        self.scale = size[0] / REFERENCE_WIDTH
+
+        self.outline = Image.open(OUTLINE_PATH).convert("RGBA")
+
+        # font file is assumed to exist under static/
+        font_path = os.path.join(FONT_BASE_PATH, "Inter-Bold.ttf")
+        self.font = ImageFont.truetype(font_path, self.px(50))
+
+        self.outlines: dict[tuple[int, int], Image.Image] = {}
+
+        # compositing runs on several threads; Pillow releases the GIL for decoding, resizing, and encoding, but a
+        # FreeType face can't be shared by two threads at once
+        self.lock = threading.Lock()
+
+        self.cache = cache
+        self.fingerprint = make_key(COMPOSITE_VERSION, hash_file(OUTLINE_PATH), hash_file(font_path), size, quality)
+
+        # image contents by path; seeded from the download manifest, which has already hashed them
+        self.digests: dict[str, str] = {}
+
+    def px(self, n: int) -> int:
+        """
+        Scale a length, in full-size pixels, to the output size.
+        """
+        return max(1, round(n * self.scale))
+
+    def outline_mask(self, size: tuple[int, int]) -> Image.Image:
+        """
+        The outline, resized to the given size; cached, since every secondary image is the same size.
+        """
+        with self.lock:
+            if size not in self.outlines:
+                self.outlines[size] = self.outline.resize(size)
+
+            return self.outlines[size]
+
+    def composite(self, label: str, primary_path: str, secondary_path: str | None) -> Image.Image:
+        """
+        Combine the primary image with the secondary image, and draw the label at the bottom.
+
+        Without a secondary image (i.e., for previews), only the label is drawn onto the primary image.
+        """
+        # the result is saved as RGB anyway, and drawing in RGB gives the same pixels as RGBA for less work
+        primary_image = load_image(primary_path, self.size).convert("RGB")
+        width, height = primary_image.size
+
+        if secondary_path is not None:
+            # Load the secondary image at a fraction the size of the primary image
+            secondary_image = load_image(secondary_path, self.secondary_size).convert("RGBA")
+
+            # Create border around secondary image; doing it at the final size multiplies 9x fewer pixels
+            secondary_image = ImageChops.multiply(self.outline_mask(self.secondary_size), secondary_image)
+
+            # Overlay secondary image on top-left corner of primary image
+            primary_image.paste(secondary_image, (self.px(10), self.px(10)), secondary_image)
+
+        draw = ImageDraw.Draw(primary_image)
+
+        with self.lock:
+            text_bbox = draw.textbbox((0, 0), label, font=self.font)
+
+        # Calculate the position to center the text
+        x = (width - text_bbox[2]) // 2
+        y = (height - text_bbox[3]) - self.px(50)
+
+        # Calculate the size of the rectangle to fill the text_bbox
+        rect_width = text_bbox[2] + self.px(20)  # Add some padding
+        rect_height = text_bbox[3] + self.px(20)  # Add some padding
+
+        # Draw a filled rectangle as the background; in RGB, the opacity only survived as far as this colour anyway
+        draw.rectangle(
+            (
+                (x - self.px(30), y - self.px(15)),
+                (x + rect_width + self.px(10), y + rect_height + self.px(10)),
+            ),
+            fill=(0, 0, 0, self.text_opacity),
+        )
+
+        # Draw the text on the image
+        with self.lock:
+            draw.text((x, y), label, font=self.font, fill="white")
+
+        return primary_image
+
+    def digest(self, path: str) -> str:
+        """
+        The SHA-256 of an image's contents, hashing it only if the manifest didn't already.
+        """
+        if path not in self.digests:
+            self.digests[path] = hash_file(path)
+
+        return self.digests[path]
+
+    def cache_key(self, label: str, primary_path: str, secondary_path: str | None) -> str:
+        """
+        The key of a day's composite in the cache.
+        """
+        secondary_digest = self.digest(secondary_path) if secondary_path is not None else None
+        return make_key(self.fingerprint, label, self.digest(primary_path), secondary_digest)
+
+    def frame(self, label: str, primary_path: str, secondary_path: str | None) -> np.ndarray:
+        """
+        A day's composite as an RGB array, from the cache if possible.
+        """
+        if self.cache is None:
+            return np.asarray(self.composite(label, primary_path, secondary_path))
+
+        key = self.cache_key(label, primary_path, secondary_path)
+        if (cached_path := self.cache.get(key)) is not None:
+            with Image.open(cached_path) as cached_image:
+                return np.asarray(cached_image.convert("RGB"))
+
+        primary_image = self.composite(label, primary_path, secondary_path)
+        self.cache.put(key, lambda path: primary_image.save(path, format="JPEG", quality=self.quality))
+
+        return np.asarray(primary_image)
+
+    def warm(self, label: str, primary_path: str, secondary_path: str | None) -> None:
+        """
+        Composite a day into the cache, unless it's already there, so whatever needs it later only has to look it up.
+        """
+        if self.cache is None:
+            return None
+
+        key = self.cache_key(label, primary_path, secondary_path)
+        if self.cache.get(key) is not None:
+            return None
+
+        primary_image = self.composite(label, primary_path, secondary_path)
+        self.cache.put(key, lambda path: primary_image.save(path, format="JPEG", quality=self.quality))
+        return None
+
+    def process_image(self, label: str, primary_path: str, secondary_path: str | None, output_folder: str) -> None:
+        """
+        Composite a day's images, and save the result in the output folder.
+        """
+        output_path = os.path.join(output_folder, f"combined_{os.path.basename(primary_path)}")
+
+        if self.cache is not None:
+            key = self.cache_key(label, primary_path, secondary_path)
+
+            if (cached_path := self.cache.get(key)) is not None:
+                shutil.copyfile(cached_path, output_path)
+                logger.debug("Combined image copied from cache to %s", output_path)
+                return None
+
+        primary_image = self.composite(label, primary_path, secondary_path)
 
-    # Extract prefix from primary filename
-    primary_prefix = primary_filename.split("_")[0]
+        # Save the result in the output folder
+        primary_image.save(output_path, quality=self.quality)
 
-    # Check if there's a corresponding file in the secondary folder with the same prefix
-    secondary_files = [file for file in os.listdir(secondary_folder) if file.startswith(primary_prefix)]
+        if self.cache is not None:
+            self.cache.put(key, lambda path: shutil.copyfile(output_path, path))
 
-    if not secondary_files:
+        logger.debug("Combined image saved at %s", output_path)
         return None
 
-    # Use the first matching file in the secondary folder
-    secondary_filename = secondary_files[0]
 
-    primary_path = os.path.join(primary_folder, primary_filename)
-    secondary_path = os.path.join(secondary_folder, secondary_filename)
+def composite_cache() -> DiskCache | None:
+    """
+    The cache of composites shared by every job, or None if it's disabled (i.e., composite_cache_mb is 0).
+    """
+    if COMPOSITE_CACHE_MB <= 0:
+        return None
 
-    # Load primary and secondary images
-    primary_image = Image.open(primary_path)
-    secondary_image = Image.open(secondary_path)
-    source = Image.open(os.path.join(os.getcwd(), OUTLINE_PATH))
+    return DiskCache(os.path.join(CACHE_PATH, "composites"), COMPOSITE_CACHE_MB * 1024 * 1024, suffix=".jpg")
 
-    primary_image = primary_image.convert("RGBA")
-    secondary_image = secondary_image.convert("RGBA")
-    source = source.convert("RGBA")
 
-    # Create border around secondary image
-    secondary_image = ImageChops.multiply(source, secondary_image)
+def finish_cache(compositor: Compositor) -> None:
+    """
+    Log how the compositor's cache did, and bring it back under its size limit.
+    """
+    if compositor.cache is None:
+        return None
 
-    # Resize secondary image to fraction the size of the primary image
-    width, height = primary_image.size
-    new_size = (width // 3, height // 3)
-    secondary_image = secondary_image.resize(new_size)
+    logger.info("Composite cache: %s", compositor.cache.summary())
+    compositor.cache.evict()
+    return None
 
-    # Overlay secondary image on top-left corner of primary image
-    primary_image.paste(secondary_image, (10, 10), secondary_image)
 
-    width, height = primary_image.size
-    draw = ImageDraw.Draw(primary_image)
+def composite_all(compositor: Compositor, pairs: list[ImagePair], output_folder: str, workers: int) -> None:
+    """
+    Composite every pair into the output folder, spread over a pool of threads.
+
+    Threads rather than processes: celery's prefork workers are daemonic, and daemonic processes can't have children.
+    """
+    if workers <= 1:
+        for label, primary_path, secondary_path in pairs:
+            compositor.process_image(label, primary_path, secondary_path, output_folder)
+        return
 
-    # font file is assumed to exist under static/
-    font_path = os.path.join(FONT_BASE_PATH, "Inter-Bold.ttf")
-    font = ImageFont.truetype(font_path, font_size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(compositor.process_image, label, primary_path, secondary_path, output_folder)
+            for label, primary_path, secondary_path in pairs
+        ]
 
-    text_bbox = draw.textbbox((0, 0), primary_prefix, font=font)
+        for future in as_completed(futures):
+            future.result()
 
-    # Calculate the position to center the text
-    x = (width - text_bbox[2]) // 2
-    y = (height - text_bbox[3]) - offset
 
-    # Calculate the size of the rectangle to fill the text_bbox
-    rect_width = text_bbox[2] + 20  # Add some padding
-    rect_height = text_bbox[3] + 20  # Add some padding
+def image_folders(phone: str, year: str, preview: bool = False) -> tuple[str, str | None, str]:
+    """
+    Return the primary, secondary (None for previews), and output folders for a user's year.
+    """
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+
+    if preview:
+        return os.path.join(year_path, "thumbnail"), None, os.path.join(year_path, "preview")
 
-    # Draw a semi-transparent filled rectangle as the background
-    draw.rectangle(
-        ((x - 30, y - 15), (x + rect_width + 10, y + rect_height + 10)),
-        fill=(0, 0, 0, text_opacity),
+    return (
+        os.path.join(year_path, "primary"),
+        os.path.join(year_path, "secondary"),
+        os.path.join(year_path, "combined"),
     )
 
-    # Draw the text on the image
-    draw.text((x, y), primary_prefix, font=font, fill="white")
-    # Save the modified image
 
-    # Save the result in the output folder
-    output_path = os.path.join(output_folder, f"combined_{primary_filename}")
+@dataclass
+class FrameStream:
+    """
+    A year's composited frames, produced in order on demand rather than written to disk.
+    """
+
+    count: int
+    frames: Iterator[np.ndarray]
+
+
+def composite_frames(compositor: Compositor, pairs: list[ImagePair], workers: int, buffer: int) -> Iterator[np.ndarray]:
+    """
+    Composite every pair in order, yielding each as an RGB array.
+
+    Up to `buffer` frames are composited ahead of the consumer, on a pool of threads; no more are held in memory.
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        in_flight: deque[Future[np.ndarray]] = deque()
+
+        for label, primary_path, secondary_path in pairs:
+            in_flight.append(pool.submit(compositor.frame, label, primary_path, secondary_path))
+
+            if len(in_flight) >= buffer:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    finish_cache(compositor)
 
-    # ensure the photo is jpg ready
-    primary_image = primary_image.convert("RGB")
 
-    primary_image.save(output_path, quality=IMAGE_QUALITY)
+def stream_images(
+    phone: str,
+    year: str,
+    preview: bool = False,
+    workers: int = COMPOSITE_WORKERS,
+) -> FrameStream:
+    """
+    Like create_images, but stream the composites straight to the encoder instead of saving them as JPEGs.
 
-    logger.debug("Combined image saved at %s", output_path)
+    This skips a JPEG encode and decode per frame (and the quality lost to them), at the cost of the composites not
+    being around afterwards; use create_images to inspect them.
+    """
+    primary_folder, secondary_folder, _ = image_folders(phone, year, preview)
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+
+    pairs, report = pair_images(year_path, primary_folder, secondary_folder)
+    log_pairing_report(report)
+
+    # there's no output JPEG to match, so cache at a quality that's close to lossless
+    compositor = Compositor(
+        PREVIEW_RENDER_SIZE if preview else RENDER_SIZE, quality=COMPOSITE_CACHE_QUALITY, cache=composite_cache()
+    )
+    compositor.digests.update(index_digests(year_path, preview))
+
+    logger.info("Streaming %d days with %d workers...", len(pairs), workers)
+    return FrameStream(len(pairs), composite_frames(compositor, pairs, workers, FRAME_BUFFER))
 
 
 def create_images(
     phone: str,
     year: str,
+    preview: bool = False,
+    workers: int = COMPOSITE_WORKERS,
 ) -> str:
     """
     Put secondary images on top of primary images.
+
+    In preview mode, label the (low-resolution) thumbnails instead; they already show both cameras.
     """
-    primary_folder = os.path.join(CONTENT_PATH, phone, year, "primary")
-    secondary_folder = os.path.join(CONTENT_PATH, phone, year, "secondary")
-    output_folder = os.path.join(CONTENT_PATH, phone, year, "combined")
+    primary_folder, secondary_folder, output_folder = image_folders(phone, year, preview)
 
     os.makedirs(primary_folder, exist_ok=True)
-    os.makedirs(secondary_folder, exist_ok=True)
+    if secondary_folder is not None:
+        os.makedirs(secondary_folder, exist_ok=True)
+
+    # a partly-filled output folder may be left by a run that was killed; whether it's complete is up to the caller's
+    # checkpoint, and the composite cache makes redoing what's already there cheap
+    os.makedirs(output_folder, exist_ok=True)
+
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+
+    pairs, report = pair_images(year_path, primary_folder, secondary_folder)
+    log_pairing_report(report)
 
-    if os.path.isdir(output_folder):
-        logger.info("Skipping 'create_images' stage; already created!")
-        return output_folder
+    compositor = Compositor(PREVIEW_RENDER_SIZE if preview else RENDER_SIZE, cache=composite_cache())
+    compositor.digests.update(index_digests(year_path, preview))
 
+    logger.info("Compositing %d days with %d workers...", len(pairs), workers)
+    composite_all(compositor, pairs, output_folder, workers)
+    finish_cache(compositor)
+
+    return output_folder
+
+
+def composite_shard(
+    phone: str,
+    year: str,
+    shard: int,
+    shards: int,
+    preview: bool = False,
+    workers: int = COMPOSITE_WORKERS,
+) -> str:
+    """
+    Like create_images, but only composite every `shards`-th day, starting from day `shard`.
+
+    Together, shards 0 to shards - 1 composite the whole year, and can do so on different workers at once.
+    """
+    primary_folder, secondary_folder, output_folder = image_folders(phone, year, preview)
     os.makedirs(output_folder, exist_ok=True)
 
-    # Get a list of primary filenames
-    primary_filenames = os.listdir(primary_folder)
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+    pairs, report = pair_images(year_path, primary_folder, secondary_folder)
 
-    # NOTE(michaelfromyeg): because we're using celery, the below code is unusable
-    # specifically, "AssertionError: daemonic processes are not allowed to have children"
+    # every shard sees the same report, so only the first one needs to mention it
+    if shard == 0:
+        log_pairing_report(report)
 
-    for primary_filename in primary_filenames:
-        process_image(primary_filename, primary_folder, secondary_folder, output_folder)
+    compositor = Compositor(PREVIEW_RENDER_SIZE if preview else RENDER_SIZE, cache=composite_cache())
+    compositor.digests.update(index_digests(year_path, preview))
 
-    # Use multiprocessing to process images in parallel
-    # processes = max(1, multiprocessing.cpu_count() - 2)
-    # with Pool(processes=processes) as pool:
-    #     pool.starmap(
-    #         process_image,
-    #         [
-    #             (primary_filename, primary_folder, secondary_folder, output_folder)
-    #             for primary_filename in primary_filenames
-    #         ],
-    #     )
+    logger.info(
+        "Compositing shard %d of %d (%d days) with %d workers...", shard + 1, shards, len(pairs[shard::shards]), workers
+    )
+    composite_all(compositor, pairs[shard::shards], output_folder, workers)
+    finish_cache(compositor)
 
     return output_folder
 
 
-def cleanup_images(phone: str, year: str) -> None:
+def cleanup_images(phone: str, year: str, preview: bool = False) -> None:
     """
     Delete all the images in the primary and secondary folders.
+
+    In preview mode, only delete the preview's own folders; a full render of the same year may still need the rest.
     """
-    path = os.path.join(CONTENT_PATH, phone, year)
-
-    try:
-        shutil.rmtree(path)
-        logger.info("Successfully removed %s", path)
-    except FileNotFoundError:
-        logger.info("The directory %s does not exist", path)
-    except PermissionError:
-        logger.error("Permission denied while attempting to remove %s", path)
-    except Exception as e:
-        logger.error("An error occurred: %s", e)
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+    paths = [os.path.join(year_path, "thumbnail"), os.path.join(year_path, "preview")] if preview else [year_path]
+
+    for path in paths:
+        try:
+            shutil.rmtree(path)
+            logger.info("Successfully removed %s", path)
+        except FileNotFoundError:
+            logger.info("The directory %s does not exist", path)
+        except PermissionError:
+            logger.error("Permission denied while attempting to remove %s", path)
+        except Exception as e:
+            logger.error("An error occurred: %s", e)
 
     return None
@@ -0,0 +1,329 @@
+"""
+Keep track of the videos being made, in Redis, so that asking for a video that's already on its way (or done) gets
+that one, rather than starting the same 15-minute render again.
+
+A job is identified by everything that goes into its video: the user, the year, the song's contents, the mode, and
+the render settings. Its record maps that to the task making it and the file it's written to.
+
+Each phone's unfinished jobs are tracked too, so a new request can cancel the ones it supersedes, and so no one user
+can have more than MAX_JOBS_PER_PHONE at once. A cancelled job's stages stop as soon as they start, and the ones
+already running are terminated (see cancel_job in celery.py).
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import TypedDict, cast
+
+import redis
+from celery.result import AsyncResult
+
+from .beats import song_digest
+from .cache import make_key
+from .logger import logger
+from .utils import (
+    CLASSIC_DURATION,
+    ENDCARD_DURATION,
+    EXPORTS_PATH,
+    INTRO_DURATION,
+    MAX_JOBS_PER_PHONE,
+    PREVIEW_RENDER_SIZE,
+    REDIS_HOST,
+    REDIS_PORT,
+    RENDER_ENGINE,
+    RENDER_SIZE,
+    Mode,
+)
+
+JOB_VERSION = 1
+
+# a finished job's export is only kept for about a day (see delete_old_videos), so its record needn't outlive that
+JOB_TTL = 24 * 60 * 60
+
+# the states of a task that hasn't finished (or failed) yet; a task Celery has never heard of is PENDING, too
+IN_FLIGHT_STATES = {"PENDING", "RECEIVED", "STARTED", "RETRY"}
+
+# how long past its deadline a job that's still PENDING is given up on; its record may just never have been updated
+# (e.g., its worker died with it), and it shouldn't be handed out, or count against its phone, for the rest of JOB_TTL
+DEADLINE_GRACE = timedelta(hours=1)
+
+# the broker uses database 0, and the rate limiter database 1
+jobs_redis = redis.Redis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}/2")
+
+
+class Job(TypedDict):
+    """
+    A video that's being (or has been) made, as stored in Redis.
+    """
+
+    task_id: str
+    video_file: str
+
+
+class PhoneJob(TypedDict):
+    """
+    One of a phone's unfinished jobs, as stored in Redis.
+    """
+
+    task_id: str
+    key: str
+    year: str
+    preview: bool
+
+
+def job_key(phone: str, year: str, song_path: str, mode: Mode, preview: bool = False) -> str:
+    """
+    The key of the job that makes this video; two requests for the same video have the same key.
+    """
+    size = PREVIEW_RENDER_SIZE if preview else RENDER_SIZE
+    digest = make_key(
+        JOB_VERSION,
+        phone,
+        year,
+        song_digest(song_path),
+        mode,
+        preview,
+        size,
+        RENDER_ENGINE,
+        INTRO_DURATION,
+        ENDCARD_DURATION,
+        CLASSIC_DURATION,
+    )
+
+    return f"job:{digest}"
+
+
+def export_path(job: Job) -> str:
+    """
+    Where a job's video is written to.
+    """
+    return os.path.join(EXPORTS_PATH, job["video_file"])
+
+
+def job_state(job: Job) -> str:
+    """
+    The state of the task making a job's video (e.g., PENDING, SUCCESS, FAILURE).
+    """
+    return AsyncResult(job["task_id"]).state
+
+
+def deadline_key(task_id: str) -> str:
+    """
+    The Redis key of the time a job is expected to be done by.
+    """
+    return f"job:{task_id}:deadline"
+
+
+def set_deadline(task_id: str, deadline: datetime) -> None:
+    """
+    Record when a job is expected to be done by (e.g., its estimated finish).
+    """
+    jobs_redis.set(deadline_key(task_id), deadline.isoformat(), ex=JOB_TTL)
+    return None
+
+
+def is_in_flight(task_id: str) -> bool:
+    """
+    Whether a job's task hasn't finished (or failed) yet; a job that's still PENDING well past its deadline is taken
+    to have been lost.
+    """
+    state = AsyncResult(task_id).state
+
+    if state not in IN_FLIGHT_STATES:
+        return False
+
+    raw = cast(bytes | None, jobs_redis.get(deadline_key(task_id)))
+
+    if state == "PENDING" and raw is not None:
+        if datetime.now(timezone.utc) > datetime.fromisoformat(raw.decode()) + DEADLINE_GRACE:
+            logger.warning("Giving up on job %s; it's well past its deadline", task_id)
+            return False
+
+    return True
+
+
+def is_finished(job: Job) -> bool:
+    """
+    Whether a job's video is done and can still be downloaded.
+    """
+    return job_state(job) == "SUCCESS" and os.path.isfile(export_path(job))
+
+
+def is_reusable(job: Job) -> bool:
+    """
+    Whether a job is still on its way, or done with its video still around; i.e., whether an identical request can be
+    handed this job instead of starting another.
+    """
+    return is_in_flight(job["task_id"]) or is_finished(job)
+
+
+def find_job(key: str) -> Job | None:
+    """
+    The job recorded under a key, if an identical request can be handed it.
+    """
+    raw = cast(bytes | None, jobs_redis.get(key))
+
+    if raw is None:
+        return None
+
+    job: Job = json.loads(raw)
+    return job if is_reusable(job) else None
+
+
+def claim_job(key: str, job: Job) -> tuple[Job, bool]:
+    """
+    Record a new job under its key, unless an identical job can be reused.
+
+    Return the job to hand back, and whether it's the new one (which the caller must then start). Two identical
+    requests at once can't both claim a job; the second one gets the first one's.
+    """
+    while True:
+        with jobs_redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+
+                raw = cast(bytes | None, pipe.get(key))
+                existing: Job | None = json.loads(raw) if raw is not None else None
+
+                if existing is not None and is_reusable(existing):
+                    pipe.unwatch()
+                    logger.info("Reusing job %s for %s", existing["task_id"], key)
+                    return existing, False
+
+                pipe.multi()
+                pipe.set(key, json.dumps(job), ex=JOB_TTL)
+                pipe.execute()
+
+                return job, True
+            except redis.WatchError:
+                # another request changed the record while this one was looking at it; look again
+                continue
+
+
+def release_job(key: str, job: Job) -> None:
+    """
+    Forget a job that was claimed but never started, unless another job has taken its place already.
+    """
+    raw = cast(bytes | None, jobs_redis.get(key))
+
+    if raw is not None and json.loads(raw)["task_id"] == job["task_id"]:
+        jobs_redis.delete(key)
+
+    return None
+
+
+def phone_jobs_key(phone: str) -> str:
+    """
+    The Redis hash of a phone's unfinished jobs, by task id.
+    """
+    return f"phone:{phone}:jobs"
+
+
+def track_job(phone: str, job: PhoneJob) -> None:
+    """
+    Add a job to its phone's unfinished jobs.
+    """
+    name = phone_jobs_key(phone)
+
+    jobs_redis.hset(name, job["task_id"], json.dumps(job))
+    jobs_redis.expire(name, JOB_TTL)
+
+    return None
+
+
+def active_jobs(phone: str) -> list[PhoneJob]:
+    """
+    A phone's unfinished jobs; forget any that have finished (or failed, or been cancelled) since they were tracked.
+    """
+    name = phone_jobs_key(phone)
+    raw_jobs = cast(dict[bytes, bytes], jobs_redis.hgetall(name))
+
+    jobs: list[PhoneJob] = []
+    for raw in raw_jobs.values():
+        job: PhoneJob = json.loads(raw)
+
+        if is_in_flight(job["task_id"]):
+            jobs.append(job)
+        else:
+            jobs_redis.hdel(name, job["task_id"])
+
+    return jobs
+
+
+def superseded_jobs(phone: str, year: str, preview: bool = False) -> list[PhoneJob]:
+    """
+    The unfinished jobs a new request for this phone and year replaces; a preview only replaces another preview.
+    """
+    return [job for job in active_jobs(phone) if job["year"] == year and job["preview"] == preview]
+
+
+def at_capacity(phone: str, replacing: int = 0) -> bool:
+    """
+    Whether a phone already has as many unfinished jobs as it's allowed, not counting the `replacing` jobs a new one
+    would supersede.
+    """
+    return len(active_jobs(phone)) - replacing >= MAX_JOBS_PER_PHONE
+
+
+def untrack_job(phone: str, task_id: str) -> None:
+    """
+    Remove a job from its phone's unfinished jobs.
+    """
+    jobs_redis.hdel(phone_jobs_key(phone), task_id)
+    return None
+
+
+def cancelled_key(job_id: str) -> str:
+    """
+    The Redis key that marks a job as cancelled.
+    """
+    return f"job:{job_id}:cancelled"
+
+
+def mark_cancelled(job_id: str) -> None:
+    """
+    Mark a job as cancelled, so that none of its stages start from now on.
+    """
+    jobs_redis.set(cancelled_key(job_id), 1, ex=JOB_TTL)
+    return None
+
+
+def is_cancelled(job_id: str) -> bool:
+    """
+    Whether a job has been cancelled.
+    """
+    return bool(jobs_redis.exists(cancelled_key(job_id)))
+
+
+def stages_key(job_id: str) -> str:
+    """
+    The Redis set of the ids of a job's running stages.
+    """
+    return f"job:{job_id}:stages"
+
+
+def track_stage(job_id: str, task_id: str) -> None:
+    """
+    Record that one of a job's stages is running.
+    """
+    name = stages_key(job_id)
+
+    jobs_redis.sadd(name, task_id)
+    jobs_redis.expire(name, JOB_TTL)
+
+    return None
+
+
+def untrack_stage(job_id: str, task_id: str) -> None:
+    """
+    Record that one of a job's stages has stopped running.
+    """
+    jobs_redis.srem(stages_key(job_id), task_id)
+    return None
+
+
+def running_stages(job_id: str) -> list[str]:
+    """
+    The ids of a job's running stages.
+    """
+    return [task_id.decode() for task_id in cast(set[bytes], jobs_redis.smembers(stages_key(job_id)))]
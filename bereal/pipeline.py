@@ -0,0 +1,102 @@
+"""
+Overlap downloading memories with compositing them.
+
+Rather than waiting for every download to finish before compositing starts, each day's images are handed to a pool
+of compositing threads as soon as they're all on disk. The composites go into the composite cache, which the composite
+stage (or, when streaming frames, the render stage) then only has to look them up in.
+"""
+
+import os
+import threading
+from datetime import datetime
+from queue import Queue
+
+from .bereal import ManifestEntry, memories
+from .images import Compositor, ImagePair, composite_cache, finish_cache
+from .logger import logger
+from .utils import (
+    COMPOSITE_QUEUE_SIZE,
+    COMPOSITE_WORKERS,
+    CONTENT_PATH,
+    IMAGE_QUALITY,
+    PREVIEW_RENDER_SIZE,
+    RENDER_SIZE,
+)
+
+
+def download_and_composite(
+    phone: str,
+    year: str,
+    token: str,
+    sdate: datetime,
+    edate: datetime,
+    preview: bool = False,
+    quality: int = IMAGE_QUALITY,
+    workers: int = COMPOSITE_WORKERS,
+) -> bool:
+    """
+    Download a user's memories, and composite them into the composite cache as they arrive.
+
+    Return whether the memories could be fetched, as memories does. The quality must match the compositor that will
+    look the composites up later, since it's part of their cache key. With the cache disabled, this only downloads.
+    """
+    cache = composite_cache()
+    if cache is None:
+        return memories(phone, year, token, sdate, edate, preview=preview)
+
+    year_path = os.path.join(CONTENT_PATH, phone, year)
+    kinds = {"thumbnail"} if preview else {"primary", "secondary"}
+
+    compositor = Compositor(PREVIEW_RENDER_SIZE if preview else RENDER_SIZE, quality=quality, cache=cache)
+
+    # bounded, so a slow compositor applies back-pressure instead of piling up work
+    pairs: Queue[ImagePair | None] = Queue(maxsize=COMPOSITE_QUEUE_SIZE)
+    pending: dict[str, dict[str, ManifestEntry]] = {}
+
+    def on_download(entry: ManifestEntry) -> None:
+        """
+        Queue a day for compositing once every image it needs is on disk.
+        """
+        images = pending.setdefault(entry["momentId"], {})
+        images[entry["kind"]] = entry
+
+        # the download already hashed the image, so the compositor's cache lookup doesn't have to
+        compositor.digests[os.path.join(year_path, entry["path"])] = entry["sha256"]
+
+        if set(images) == kinds:
+            pending.pop(entry["momentId"])
+
+            if preview:
+                pairs.put((entry["memoryDay"], os.path.join(year_path, images["thumbnail"]["path"]), None))
+            else:
+                primary_path = os.path.join(year_path, images["primary"]["path"])
+                pairs.put((entry["memoryDay"], primary_path, os.path.join(year_path, images["secondary"]["path"])))
+
+    def composite() -> None:
+        """
+        Composite queued days until the sentinel arrives.
+        """
+        while (pair := pairs.get()) is not None:
+            label, primary_path, secondary_path = pair
+
+            # a day that fails here is only composited later, by the stage that needs it
+            try:
+                compositor.warm(label, primary_path, secondary_path)
+            except Exception as error:
+                logger.warning("Failed to composite %s ahead of time: %s", primary_path, error)
+
+    threads = [threading.Thread(target=composite, name=f"compositor-{i}", daemon=True) for i in range(max(workers, 1))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        return memories(phone, year, token, sdate, edate, preview=preview, on_download=on_download)
+    finally:
+        # one sentinel per thread
+        for _ in threads:
+            pairs.put(None)
+
+        for thread in threads:
+            thread.join()
+
+        finish_cache(compositor)
@@ -10,6 +10,7 @@ monkey.patch_all()
 
 import os  # noqa: E402
 import secrets  # noqa: E402
+import uuid  # noqa: E402
 import warnings  # noqa: E402
 from datetime import datetime, timedelta  # noqa: E402
 from typing import Any  # noqa: E402
@@ -23,10 +24,34 @@ from flask_migrate import Migrate  # noqa: E402
 from flask_sqlalchemy import SQLAlchemy  # noqa: E402
 from itsdangerous import URLSafeTimedSerializer  # noqa: E402
 
-from .bereal import send_code, verify_code  # noqa: E402
-from .celery import bcelery, make_video  # noqa: E402
+from .beats import song_digest  # noqa: E402
+from .bereal import invalidate_feed, send_code, verify_code  # noqa: E402
+from .celery import (  # noqa: E402
+    CPU_QUEUE,
+    IO_QUEUE,
+    bcelery,
+    cancel_job,
+    make_video,
+    streams_frames,
+    video_filename,
+)
+from .estimates import estimate_job, load_estimate, retry_after, save_estimate  # noqa: E402
+from .jobs import (  # noqa: E402
+    Job,
+    at_capacity,
+    claim_job,
+    find_job,
+    is_finished,
+    job_key,
+    release_job,
+    set_deadline,
+    superseded_jobs,
+    track_job,
+    untrack_job,
+)
 from .logger import logger  # noqa: E402
 from .utils import (  # noqa: E402
+    COMPOSITE_SHARDS,
     CONTENT_PATH,
     DEFAULT_SONG_PATH,
     DEFAULT_SHORT_SONG_PATH,
@@ -68,7 +93,7 @@ else:
     CORS(app, resources={r"/*": {"origins": "https://bereal.michaeldemar.co"}}, supports_credentials=True)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config["SQLALCHEMY_DATABASE_URI"] = f'sqlite:///{os.path.join(basedir, "tokens.db")}'
+app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(basedir, 'tokens.db')}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db = SQLAlchemy(app)
@@ -81,6 +106,8 @@ scheduler.start()
 app.config["CELERY_BROKER_URL"] = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 bcelery.conf.update(app.config)
 
+SONGS_FOLDER = "songs"
+
 
 class BerealToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -156,6 +183,9 @@ def validate_otp() -> tuple[Response, int]:
 
     insert_bereal_token(phone, bereal_token)
 
+    # a fresh login is a good signal the user expects up-to-date memories
+    invalidate_feed(phone)
+
     return jsonify({"bereal_token": bereal_token, "token": token}), 200
 
 
@@ -167,25 +197,27 @@ def create_video() -> tuple[Response, int]:
     phone = request.args.get("phone")
     bereal_token = request.args.get("berealToken")
 
-    if not bereal_token or bereal_token != get_bereal_token(phone):
+    if phone is None or not bereal_token or bereal_token != get_bereal_token(phone):
         return jsonify({"error": "Unauthorized", "message": "Invalid token"}), 401
 
     token = request.form["token"]
     year = request.form["year"]
     wav_file = request.files.get("file", None)
     mode_str = request.form.get("mode")
+    preview = request.form.get("preview", "").lower() in ["1", "true"]
 
     mode = str2mode(mode_str)
 
-    song_folder = os.path.join(CONTENT_PATH, phone, year)
-    os.makedirs(song_folder, exist_ok=True)
-
-    song_path = os.path.join(song_folder, "song.wav")
+    # an upload lands somewhere of its own until its job is admitted (see keep_song); a job that's already running
+    # may be reading an earlier upload for the same year
+    upload_path = os.path.join(songs_folder(phone), f"{uuid.uuid4()}.part")
+    os.makedirs(songs_folder(phone), exist_ok=True)
 
     if wav_file:
         logger.info("Downloading music file %s...", wav_file.filename)
         try:
-            wav_file.save(song_path)
+            wav_file.save(upload_path)
+            song_path = upload_path
         except Exception as error:
             logger.warning("Could not save music file, received: %s", error)
             song_path = DEFAULT_SHORT_SONG_PATH if mode == Mode.CLASSIC else DEFAULT_SONG_PATH
@@ -193,12 +225,86 @@ def create_video() -> tuple[Response, int]:
         logger.info("No music file provided; using default...")
         song_path = DEFAULT_SHORT_SONG_PATH if mode == Mode.CLASSIC else DEFAULT_SONG_PATH
 
+    try:
+        return queue_video(token, bereal_token, phone, year, song_path, mode, preview)
+    finally:
+        # unless it was kept for the job, the upload isn't needed anymore
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def queue_video(
+    token: str, bereal_token: str, phone: str, year: str, song_path: str, mode: Mode, preview: bool
+) -> tuple[Response, int]:
+    """
+    Queue a job to make a video, unless an identical one can be reused, or it's turned away.
+    """
+    # double-clicks, retries, and re-submissions of the same video get the job that's already making it
+    key = job_key(phone, year, song_path, mode, preview)
+
+    if (existing := find_job(key)) is not None:
+        return existing_job_response(existing)
+
+    # don't take on a video that would wait hours in line; ask the user to come back when it wouldn't
+    shards = 0 if streams_frames() else COMPOSITE_SHARDS
+    estimate = estimate_job(phone, year, mode, preview, IO_QUEUE, CPU_QUEUE, shards)
+
+    if (retry_seconds := retry_after(estimate)) is not None:
+        logger.warning("Turning away a video that would wait %.0fs", estimate["wait"])
+
+        response = jsonify(
+            {
+                "error": "Service Unavailable",
+                "message": "Lots of videos are being made right now. Please try again later.",
+                "retryAfter": retry_seconds,
+            }
+        )
+        response.headers["Retry-After"] = str(retry_seconds)
+        return response, 503
+
+    # a new video for the same year (e.g., with a different song) replaces the one that's on its way
+    superseded = superseded_jobs(phone, year, preview)
+
+    if at_capacity(phone, replacing=len(superseded)):
+        return jsonify(
+            {
+                "error": "Too Many Requests",
+                "message": "You already have videos on their way. Please wait for them to finish.",
+            }
+        ), 429
+
+    # only record the job once it's admitted, so an identical request is never handed one that won't be queued; if
+    # one got in first since the lookup above, hand back that one instead
+    new_job: Job = {"task_id": str(uuid.uuid4()), "video_file": video_filename(bereal_token, phone, year, preview, key)}
+    job, is_new = claim_job(key, new_job)
+
+    if not is_new:
+        return existing_job_response(job)
+
+    if song_path not in [DEFAULT_SONG_PATH, DEFAULT_SHORT_SONG_PATH]:
+        song_path = keep_song(phone, song_path)
+
+    for old_job in superseded:
+        cancel_job(old_job["task_id"])
+        untrack_job(phone, old_job["task_id"])
+
+    track_job(phone, {"task_id": job["task_id"], "key": key, "year": year, "preview": preview})
+    save_estimate(job["task_id"], estimate)
+    set_deadline(job["task_id"], datetime.fromisoformat(estimate["finish"]))
+
     logger.info("Queueing video task...")
 
-    # TODO(michaelfromyeg): replace token with bereal_token
-    task = make_video.delay(token, bereal_token, phone, year, song_path, mode)
+    try:
+        # TODO(michaelfromyeg): replace token with bereal_token
+        make_video.apply_async(
+            (token, bereal_token, phone, year, song_path, mode, preview), {"key": key}, task_id=job["task_id"]
+        )
+    except Exception:
+        release_job(key, job)
+        untrack_job(phone, job["task_id"])
+        raise
 
-    return jsonify({"taskId": task.id}), 202
+    return jsonify({"taskId": job["task_id"], "estimate": estimate}), 202
 
 
 @app.route("/status/<task_id>", methods=["GET"])
@@ -216,7 +322,7 @@ def task_status(task_id) -> tuple[Response, int]:
 
     try:
         if task.state == "PENDING":
-            response = {"status": "PENDING"}
+            response = {"status": "PENDING", "estimate": load_estimate(task_id)}
             return jsonify(response), 202
 
         if task.state == "FAILURE":
@@ -229,7 +335,11 @@ def task_status(task_id) -> tuple[Response, int]:
             }
             return jsonify(response), 500
 
-        response = {"status": task.status, "result": task.result if task.state == "SUCCESS" else None}
+        response = {
+            "status": task.status,
+            "result": task.result if task.state == "SUCCESS" else None,
+            "estimate": load_estimate(task_id),
+        }
         return jsonify(response), 200
     except Exception as e:
         # Handle cases where task is not registered or result is not JSON serializable
@@ -286,6 +396,42 @@ def internal_error(error) -> tuple[Response, int]:
     return jsonify({"error": "Internal Server Error", "message": "An internal server error occurred"}), 500
 
 
+def songs_folder(phone: str) -> str:
+    """
+    Where a user's uploaded songs are kept, each named by the SHA-256 of its contents.
+    """
+    return os.path.join(CONTENT_PATH, phone, SONGS_FOLDER)
+
+
+def keep_song(phone: str, upload_path: str) -> str:
+    """
+    Move an upload to where its job reads it from, and return that path.
+
+    A song that's already there is never replaced, since another job may be reading it; it's the same song anyway.
+    """
+    song_path = os.path.join(songs_folder(phone), f"{song_digest(upload_path)}.wav")
+
+    if os.path.isfile(song_path):
+        # keep it around for this job, too (see delete_old_songs)
+        os.utime(song_path)
+    else:
+        os.replace(upload_path, song_path)
+
+    return song_path
+
+
+def existing_job_response(job: Job) -> tuple[Response, int]:
+    """
+    The response to a request for a video that an identical job is already making (or has made).
+    """
+    if is_finished(job):
+        logger.info("Video %s is already done", job["video_file"])
+        return jsonify({"taskId": job["task_id"], "status": "SUCCESS", "result": job["video_file"]}), 200
+
+    logger.info("Video %s is already on its way", job["video_file"])
+    return jsonify({"taskId": job["task_id"], "estimate": load_estimate(job["task_id"])}), 202
+
+
 def insert_bereal_token(phone: str, bereal_token: str) -> None:
     """
     Insert a new token into the database.
@@ -347,6 +493,31 @@ def delete_old_videos() -> None:
     return None
 
 
+def delete_old_songs() -> None:
+    """
+    Delete uploaded songs (and uploads that were never kept) that are more than a day old; their jobs are long done.
+    """
+    time_limit = datetime.now() - timedelta(days=1)
+
+    for phone in os.listdir(CONTENT_PATH):
+        folder = songs_folder(phone)
+
+        if not os.path.isdir(folder):
+            continue
+
+        for filename in os.listdir(folder):
+            file_path = os.path.join(folder, filename)
+
+            if datetime.fromtimestamp(os.path.getmtime(file_path)) < time_limit:
+                try:
+                    os.remove(file_path)
+                    logger.info("Deleted song file %s", file_path)
+                except Exception as error:
+                    logger.warning("Could not delete song file %s: %s", file_path, error)
+
+    return None
+
+
 @scheduler.task("interval", id="delete_expired_tokens", hours=1, misfire_grace_time=900)
 def scheduled_token_task() -> None:
     """
@@ -363,6 +534,7 @@ def scheduled_video_task() -> None:
     """
     with app.app_context():
         delete_old_videos()
+        delete_old_songs()
 
 
 if __name__ == "__main__":
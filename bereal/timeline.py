@@ -0,0 +1,65 @@
+"""
+Work out how long each image of a slideshow is on screen, all at once, from the beats of its song.
+"""
+
+import numpy as np
+
+from .logger import logger
+from .utils import CLASSIC_DURATION, Mode
+
+# how long each image is shown if a song has no beats to go by (e.g., it's silent)
+FALLBACK_DURATION = 0.5
+
+
+def beat_durations(beat_times: list[float]) -> np.ndarray:
+    """
+    The gaps between consecutive beats, in seconds.
+    """
+    return np.diff(np.asarray(beat_times, dtype=np.float64))
+
+
+def tile(durations: np.ndarray, n: int) -> np.ndarray:
+    """
+    Exactly n durations: the durations repeated from the start as many times as needed, or cut short.
+    """
+    if len(durations) == 0:
+        logger.warning("No beats to time the slideshow to; showing each image for %ss", FALLBACK_DURATION)
+        return np.full(n, FALLBACK_DURATION)
+
+    return np.resize(durations, n)
+
+
+def accel_decel(
+    durations: np.ndarray, new_duration: float, abruptness: float = 1.0, soonness: float = 1.0
+) -> np.ndarray:
+    """
+    The durations after moviepy's vfx.accel_decel(new_duration=...): slow, then fast, then slow again, and exactly
+    new_duration long in total.
+
+    accel_decel maps each output time to a source time; inverting that map at the source times where the images
+    change gives the output times where they change.
+    """
+    starts = np.concatenate([[0.0], np.cumsum(durations)])
+    progress = starts / starts[-1]
+
+    # invert f1(u) = 0.5 ** (1 - a) * u ** a on the first half, and f2(u) = 1 - f1(1 - u) on the second
+    a = 1.0 + abruptness
+    u = np.where(
+        progress < 0.5,
+        (progress / 0.5 ** (1 - a)) ** (1 / a),
+        1 - ((1 - progress) / 0.5 ** (1 - a)) ** (1 / a),
+    )
+
+    return np.diff(new_duration * u ** (1 / soonness))
+
+
+def build_timeline(beat_times: list[float], n_images: int, mode: Mode = Mode.CLASSIC) -> list[float]:
+    """
+    How long each of n_images images is shown for: one beat each, eased to CLASSIC_DURATION seconds in classic mode.
+    """
+    durations = tile(beat_durations(beat_times), n_images)
+
+    if mode == Mode.CLASSIC:
+        durations = accel_decel(durations, CLASSIC_DURATION)
+
+    return durations.tolist()
@@ -3,10 +3,13 @@ Utility functions and constants.
 """
 
 import configparser
+import json
 import os
 import subprocess
+import threading
 from datetime import datetime
 from enum import StrEnum
+from typing import Any
 
 from dotenv import load_dotenv
 
@@ -45,6 +48,31 @@ class Mode(StrEnum):
     MODERN = "modern"
 
 
+class RenderEngine(StrEnum):
+    """
+    What encodes the slideshow: moviepy, frame by frame, or ffmpeg, image by image.
+    """
+
+    MOVIEPY = "moviepy"
+    FFMPEG = "ffmpeg"
+
+
+# how long a classic video is, in seconds, however many images it has
+CLASSIC_DURATION = 30
+
+
+class FrameMode(StrEnum):
+    """
+    Where composited frames go on their way to the encoder.
+    """
+
+    # written to 'combined/' as JPEGs, then read back; handy for debugging
+    DISK = "disk"
+
+    # streamed straight from the compositor to the encoder
+    MEMORY = "memory"
+
+
 def str2mode(s: str | None) -> Mode:
     """
     Convert a string to a Mode object.
@@ -82,9 +110,11 @@ OUTLINE_PATH = os.path.join(IMAGES_PATH, "secondary_image_outline.png")
 
 CONTENT_PATH = os.path.join(CWD, "content")
 EXPORTS_PATH = os.path.join(CWD, "exports")
+CACHE_PATH = os.path.join(CWD, "cache")
 
 os.makedirs(CONTENT_PATH, exist_ok=True)
 os.makedirs(EXPORTS_PATH, exist_ok=True)
+os.makedirs(CACHE_PATH, exist_ok=True)
 
 # Config variables
 config = configparser.ConfigParser()
@@ -104,6 +134,58 @@ logger.info("REDIS_HOST: %s, REDIS_PORT: %s", REDIS_HOST, REDIS_PORT)
 
 TIMEOUT = config.getint("bereal", "timeout", fallback=10)
 IMAGE_QUALITY = config.getint("bereal", "image_quality", fallback=50)
+DOWNLOAD_WORKERS = config.getint("bereal", "download_workers", fallback=8)
+DOWNLOAD_TIMEOUT = config.getint("bereal", "download_timeout", fallback=10)
+API_RETRIES = config.getint("bereal", "api_retries", fallback=3)
+API_BACKOFF = config.getfloat("bereal", "api_backoff", fallback=1.0)
+API_MAX_BACKOFF = config.getfloat("bereal", "api_max_backoff", fallback=30.0)
+FEED_TTL = config.getint("bereal", "feed_ttl", fallback=3600)
+COMPOSITE_QUEUE_SIZE = config.getint("bereal", "composite_queue_size", fallback=32)
+COMPOSITE_WORKERS = config.getint("bereal", "composite_workers", fallback=4)
+
+# how many compositing tasks a video is split into, for different workers to take on at once
+COMPOSITE_SHARDS = config.getint("bereal", "composite_shards", fallback=4)
+
+# how many times a failed (or killed) stage of a job is retried before the job fails
+STAGE_RETRIES = config.getint("bereal", "stage_retries", fallback=3)
+
+# how many unfinished videos (previews included) one phone number can have at once
+MAX_JOBS_PER_PHONE = config.getint("bereal", "max_jobs_per_phone", fallback=2)
+
+# how many tasks each queue's workers run at once (see docker-compose.yml), to estimate how long a new job would wait
+IO_WORKERS = config.getint("bereal", "io_workers", fallback=4)
+CPU_WORKERS = config.getint("bereal", "cpu_workers", fallback=1)
+
+# new videos are turned away while they'd wait longer than this, in seconds, to be made
+MAX_QUEUE_WAIT = config.getint("bereal", "max_queue_wait", fallback=3600)
+
+# how many recent durations of each stage to estimate from
+STATS_WINDOW = config.getint("bereal", "stats_window", fallback=50)
+
+# every frame of a video is composited to exactly this size; x264 needs both dimensions to be even
+RENDER_SIZE = (
+    config.getint("bereal", "render_width", fallback=1080) // 2 * 2,
+    config.getint("bereal", "render_height", fallback=1440) // 2 * 2,
+)
+PREVIEW_RENDER_SIZE = (RENDER_SIZE[0] // 2 // 2 * 2, RENDER_SIZE[1] // 2 // 2 * 2)
+
+FRAME_MODE = FrameMode(config.get("bereal", "frame_mode", fallback=FrameMode.MEMORY))
+FRAME_BUFFER = config.getint("bereal", "frame_buffer", fallback=8)
+
+# the ffmpeg engine reads its images from disk, so frame_mode only applies to moviepy
+RENDER_ENGINE = RenderEngine(config.get("bereal", "render_engine", fallback=RenderEngine.FFMPEG))
+ENCODE_SEGMENTS = config.getint("bereal", "encode_segments", fallback=4)
+
+# composites are kept across jobs, so re-rendering a year (e.g., with another song) doesn't composite it again
+COMPOSITE_CACHE_MB = config.getint("bereal", "composite_cache_mb", fallback=2048)
+COMPOSITE_CACHE_QUALITY = config.getint("bereal", "composite_cache_quality", fallback=90)
+BEAT_CACHE_MB = config.getint("bereal", "beat_cache_mb", fallback=64)
+AUDIO_CACHE_MB = config.getint("bereal", "audio_cache_mb", fallback=256)
+CARD_CACHE_MB = config.getint("bereal", "card_cache_mb", fallback=256)
+
+# how long the title cards before and after a slideshow are shown, in seconds; 0 leaves them out
+INTRO_DURATION = config.getfloat("bereal", "intro_duration", fallback=2.0)
+ENDCARD_DURATION = config.getfloat("bereal", "endcard_duration", fallback=3.0)
 
 
 # Utility methods
@@ -144,3 +226,17 @@ def str2datetime(s: str) -> datetime:
     Convert a string to a datetime object.
     """
     return datetime.strptime(s, "%Y-%m-%d")
+
+
+def write_json(path: str, data: Any) -> None:
+    """
+    Atomically write data as JSON to path; readers never see a half-written file.
+
+    Each writer has its own partial file, so two writing the same path at once don't clobber each other's.
+    """
+    partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+    with open(partial_path, "w") as json_file:
+        json.dump(data, json_file, indent=2)
+
+    os.replace(partial_path, path)
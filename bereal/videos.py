@@ -2,107 +2,126 @@
 This script generates a slideshow from a folder of images and a music file.
 """
 
+import bisect
 import os
 
-import librosa
+import numpy as np
 
 from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.video.VideoClip import VideoClip
 from moviepy.video.fx import all as vfx
 from moviepy.video.io.ImageSequenceClip import ImageSequenceClip
 
-from PIL import Image, ImageDraw, ImageFont
-
+from .audio import encode_audio
+from .beats import analysis_seconds, find_beats
+from .cards import endcard_segment, intro_segment
+from .encoder import encode_slideshow
+from .images import FrameStream
+from .timeline import build_timeline
 from .logger import logger
 from .utils import (
-    CONTENT_PATH,
-    ENDCARD_TEMPLATE_IMAGE_PATH,
     EXPORTS_PATH,
-    FONT_BASE_PATH,
-    IMAGE_QUALITY,
+    RENDER_ENGINE,
     Mode,
+    RenderEngine,
 )
 
+PREVIEW_FPS = 12
 
-def create_endcard(phone: str, year: str, n_images: int, font_size: int = 50, offset: int = 110) -> str:
-    """
-    Dynamically the final end card image, with the centered text "n_images memories and counting...".
 
-    Return the path of the image.
+def count_images(images: str | FrameStream) -> int:
+    """
+    How many images a slideshow will have, whether they're in a folder or a stream.
     """
-    text = str(n_images) + " memories and counting..."
+    if isinstance(images, FrameStream):
+        return images.count
 
-    img = Image.open(ENDCARD_TEMPLATE_IMAGE_PATH)
-    width, height = img.size
+    return len(os.listdir(images)) if os.path.isdir(images) else 0
 
-    draw = ImageDraw.Draw(img)
 
-    # choose a font; the file is assumed to exist under static/
-    font_path = os.path.join(FONT_BASE_PATH, "Inter-SemiBold.ttf")
-    font = ImageFont.truetype(font_path, font_size)
+class StreamClip(VideoClip):
+    """
+    Like ImageSequenceClip, but over a stream of frames that are only composited when the encoder reaches them.
+
+    Frames must be requested in (non-decreasing) time order, which is how clips are written.
+    """
 
-    # Get the bounding box of the text
-    text_bbox = draw.textbbox((0, 0), text, font=font)
+    def __init__(self, stream: FrameStream, durations: list[float]) -> None:
+        starts = [0.0, *np.cumsum(durations)]
+        count = stream.count
 
-    # Calculate the position to center the text
-    x = (width - text_bbox[2]) // 2
-    y = (height - text_bbox[3]) // 2 + offset
+        self.frames = stream.frames
+        self.index = -1
+        self.frame: np.ndarray | None = None
 
-    draw.text((x, y), text, font=font, fill="white")
+        def make_frame(t: float) -> np.ndarray:
+            # as in ImageSequenceClip, the last image stays up until the durations run out
+            index = min(bisect.bisect_right(starts, t) - 1, count - 1)
 
-    encard_image_path = os.path.join(CONTENT_PATH, phone, year, "endcard.png")
+            while self.index < index:
+                self.frame = next(self.frames)
+                self.index += 1
 
-    img = img.convert("RGB")
-    img.save(encard_image_path, quality=IMAGE_QUALITY)
+            assert self.frame is not None
+            return self.frame
 
-    return encard_image_path
+        super().__init__(make_frame, duration=sum(durations))
 
 
 def create_slideshow3(
     phone: str,
     year: str,
-    input_folder: str,
+    images: str | FrameStream,
     output_file: str,
     music_file: str | None,
-    timestamps: list[float],
-    mode: Mode = Mode.CLASSIC,
+    durations: list[float],
+    preview: bool = False,
 ) -> None:
     """
-    Create a video slideshow from a target set of images.
+    Create a video slideshow from a target set of images (either a folder of them, or a stream), each shown for its
+    duration; see build_timeline.
+
+    Previews trade quality for speed: a lower frame rate and the fastest x264 preset.
+
+    With the ffmpeg engine, a folder of images is encoded one frame per image instead, between an intro and end card;
+    streams still go through moviepy, which pulls their frames as it needs them, and which has no cards, since
+    compositing them in would slow down every frame.
     """
     logger.debug("Creating slideshow for %s, %s", phone, year)
 
-    if not os.path.isdir(input_folder):
+    if isinstance(images, str) and not os.path.isdir(images):
         raise ValueError("Input folder does not exist!")
 
     if music_file is not None and not os.path.isfile(music_file):
         raise ValueError("Music file does not exist!")
 
-    n_images = len(os.listdir(input_folder))
+    n_images = count_images(images)
     if n_images == 0:
         raise ValueError("No images found in input folder!")
 
-    if len(timestamps) < n_images:
-        additional_needed = n_images - len(timestamps)
-
-        # Repeat the entire timestamps list as many times as needed
-        while additional_needed > 0:
-            timestamps.extend(timestamps[: min(len(timestamps), additional_needed)])
-            additional_needed = n_images - len(timestamps)
-
-    assert len(timestamps) >= n_images
-
-    main_clip = ImageSequenceClip(input_folder, durations=timestamps)
+    if len(durations) != n_images:
+        raise ValueError(f"Expected {n_images} durations, got {len(durations)}!")
 
-    # TODO(michaelfromyeg): create this file right in the input_folder?
-    # intro_clip = ...
+    if RENDER_ENGINE == RenderEngine.FFMPEG and isinstance(images, str):
+        image_paths = sorted(os.path.join(images, filename) for filename in os.listdir(images))
 
-    # endcard_image_path = create_endcard(phone=phone, year=year, n_images=n_images)
-    # endcard_clip = ImageSequenceClip([endcard_image_path], fps=1 / 3)
+        audio_file = encode_audio(music_file) if music_file is not None else None
 
-    # main_clip = concatenate_videoclips([intro_clip, main_clip, endcard_clip], method="compose")
+        encode_slideshow(
+            image_paths,
+            durations,
+            audio_file,
+            output_file,
+            preview=preview,
+            intro=intro_segment(year, preview),
+            outro=endcard_segment(n_images, preview),
+        )
+        return None
 
-    if mode == Mode.CLASSIC:
-        main_clip = main_clip.fx(vfx.accel_decel, new_duration=30)
+    if isinstance(images, str):
+        main_clip = ImageSequenceClip(images, durations=durations)
+    else:
+        main_clip = StreamClip(images, durations=durations)
 
     music = AudioFileClip(music_file)
 
@@ -117,38 +136,32 @@ def create_slideshow3(
 
     main_clip = main_clip.set_audio(music)
 
-    main_clip.write_videofile(output_file, codec="libx264", audio_codec="aac", threads=4, fps=24)
+    if preview:
+        main_clip.write_videofile(
+            output_file, codec="libx264", audio_codec="aac", threads=4, fps=PREVIEW_FPS, preset="ultrafast"
+        )
+    else:
+        main_clip.write_videofile(output_file, codec="libx264", audio_codec="aac", threads=4, fps=24)
 
     return None
 
 
-def convert_to_durations(timestamps: list[float]) -> list[float]:
-    """
-    Calculate durations between consecutive timestamps.
-    """
-    durations: list[float] = []
-
-    n = len(timestamps)
-    for i in range(1, n):  # [1...n-1]
-        duration = timestamps[i] - timestamps[i - 1]
-        durations.append(duration)
-
-    return durations
-
-
 def build_slideshow(
-    phone: str, year: str, image_folder: str, song_path: str, filename: str, mode: Mode = Mode.CLASSIC
+    phone: str,
+    year: str,
+    images: str | FrameStream,
+    song_path: str,
+    filename: str,
+    mode: Mode = Mode.CLASSIC,
+    preview: bool = False,
 ) -> None:
     """
     Create the actual slideshow.
     """
-    audio_file = librosa.load(song_path)
-    y, sr = audio_file
-    _, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-    beat_times_raw = librosa.frames_to_time(beat_frames, sr=sr)
+    n_images = count_images(images)
 
-    beat_times = convert_to_durations([float(value) for value in beat_times_raw])
-    logger.debug("Beat times: %s", beat_times)
+    durations = build_timeline(find_beats(song_path, analysis_seconds(n_images, mode)), n_images, mode)
+    logger.debug("Durations: %s", durations)
 
     output_file = os.path.join(EXPORTS_PATH, filename)
     logger.info("Creating slideshow at %s", output_file)
@@ -163,10 +176,10 @@ def build_slideshow(
     create_slideshow3(
         phone=phone,
         year=year,
-        input_folder=image_folder,
+        images=images,
         output_file=output_file,
         music_file=song_path,
-        timestamps=beat_times,
-        mode=mode,
+        durations=durations,
+        preview=preview,
     )
     return None
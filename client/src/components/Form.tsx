@@ -189,15 +189,29 @@ const Form: React.FC = () => {
         return;
       }
 
+      // an identical video was already made; skip straight to it
+      if (response.data?.status === "SUCCESS") {
+        setVideoFilename(response.data?.result);
+        setStage("videoDisplay");
+        return;
+      }
+
       setTaskId(response.data?.taskId);
 
       setStage("processing");
     } catch (error) {
-      console.error("Error submitting settings:", error);
-      throttledToast(
-        "Couldn't submit your settings. Please try again.",
-        "error"
-      );
+      const status = (error as any).response?.status;
+
+      // too many videos on their way, or too long a line; the server says which
+      if (status === 429 || status === 503) {
+        throttledToast((error as any).response.data.message, "error");
+      } else {
+        console.error("Error submitting settings:", error);
+        throttledToast(
+          "Couldn't submit your settings. Please try again.",
+          "error"
+        );
+      }
     }
   };
 
@@ -20,6 +20,7 @@ const VideoProcessor: React.FC<Props> = (props: Props) => {
 
   // eslint-disable-next-line @typescript-eslint/no-unused-vars
   const [progress, setProgress] = useState<number>(0);
+  const [finish, setFinish] = useState<string | null>(null);
 
   useEffect(() => {
     const checkProgress = async () => {
@@ -59,6 +60,7 @@ const VideoProcessor: React.FC<Props> = (props: Props) => {
               setStage("videoDisplay");
             } else {
               setProgress(logProgress(response.data));
+              setFinish(response.data?.estimate?.finish ?? null);
             }
           }
         } catch (error) {
@@ -100,6 +102,11 @@ const VideoProcessor: React.FC<Props> = (props: Props) => {
             appear when ready, and you'll also receive a text message with the
             link.
           </p>
+          {finish && (
+            <p className="text-center max-w-sm mb-3">
+              Expected to be ready by {new Date(finish).toLocaleTimeString()}.
+            </p>
+          )}
           <p className="text-white font-semibold text-center">Processing...</p>
         </div>
       ) : (
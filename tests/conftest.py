@@ -0,0 +1,8 @@
+"""
+Importing bereal needs its secrets set; tests never use them, so any value will do.
+"""
+
+import os
+
+for name in ["SECRET_KEY", "TWILIO_PHONE_NUMBER", "TWILIO_AUTH_TOKEN", "TWILIO_ACCOUNT_SID"]:
+    os.environ.setdefault(name, f"test-{name.lower()}")
@@ -0,0 +1,63 @@
+"""
+Tests for the slideshow timeline, against the moviepy effects it stands in for.
+"""
+
+import numpy as np
+import pytest
+from moviepy.video.fx.accel_decel import f_accel_decel
+
+from bereal.timeline import FALLBACK_DURATION, accel_decel, beat_durations, build_timeline, tile
+from bereal.utils import CLASSIC_DURATION, Mode
+
+
+@pytest.mark.parametrize("abruptness, soonness", [(1.0, 1.0), (0.5, 1.0), (2.0, 0.7), (1.0, 1.5)])
+@pytest.mark.parametrize("n_images", [1, 2, 7, 366])
+def test_accel_decel_matches_moviepy_at_image_boundaries(n_images: int, abruptness: float, soonness: float) -> None:
+    durations = np.random.default_rng(n_images).uniform(0.3, 1.2, n_images)
+    eased = accel_decel(durations, CLASSIC_DURATION, abruptness, soonness)
+
+    # moviepy maps each output time back to a source time; every image should change where it did in the source
+    output_starts = np.concatenate([[0.0], np.cumsum(eased)])
+    source_starts = np.concatenate([[0.0], np.cumsum(durations)])
+    mapped = f_accel_decel(output_starts, durations.sum(), CLASSIC_DURATION, abruptness, soonness)
+
+    assert len(eased) == n_images
+    assert np.all(eased > 0)
+    assert eased.sum() == pytest.approx(CLASSIC_DURATION)
+    np.testing.assert_allclose(mapped, source_starts, atol=1e-9)
+
+
+@pytest.mark.parametrize("beat_times", [[], [1.5]])
+@pytest.mark.parametrize("mode", [Mode.MODERN, Mode.CLASSIC])
+def test_build_timeline_without_beat_gaps(beat_times: list[float], mode: Mode) -> None:
+    timeline = build_timeline(beat_times, 10, mode)
+
+    assert len(timeline) == 10
+    if mode == Mode.MODERN:
+        assert timeline == [FALLBACK_DURATION] * 10
+    else:
+        assert sum(timeline) == pytest.approx(CLASSIC_DURATION)
+
+
+def test_build_timeline_more_beats_than_images() -> None:
+    beat_times = [0.0, 0.5, 1.5, 2.0, 3.0, 3.25]
+
+    assert build_timeline(beat_times, 3, Mode.MODERN) == pytest.approx([0.5, 1.0, 0.5])
+
+
+def test_build_timeline_fewer_beats_than_images() -> None:
+    beat_times = [0.0, 0.5, 1.5]
+
+    assert build_timeline(beat_times, 5, Mode.MODERN) == pytest.approx([0.5, 1.0, 0.5, 1.0, 0.5])
+
+
+def test_build_timeline_single_image() -> None:
+    assert build_timeline([0.0, 0.5, 1.5], 1, Mode.MODERN) == pytest.approx([0.5])
+    assert build_timeline([0.0, 0.5, 1.5], 1, Mode.CLASSIC) == pytest.approx([CLASSIC_DURATION])
+
+
+def test_tile() -> None:
+    assert tile(beat_durations([]), 0).tolist() == []
+    assert tile(beat_durations([]), 2).tolist() == [FALLBACK_DURATION] * 2
+    assert tile(np.array([1.0, 2.0]), 0).tolist() == []
+    assert tile(np.array([1.0, 2.0]), 3).tolist() == [1.0, 2.0, 1.0]